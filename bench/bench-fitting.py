@@ -0,0 +1,90 @@
+import sys, getopt, time
+from os.path import dirname, abspath, join, exists
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import root_mean_squared_error
+from sklearn.preprocessing import PolynomialFeatures
+from cinergy.loader import REFERENCE_HOSTS, load_training
+from cinergy.fitting import compute_models
+
+VM_SIZE = 4
+
+def print_usage():
+    print('python3 bench/bench-fitting.py [--help] [--root=. (folder where data.tar.gz was extracted)] [--host=nova,grappe,...]')
+
+###########################################
+# Former notebook implementation (in-sample degree choice)
+###########################################
+def degree_choice(x,y, degree):
+    polynomial_features= PolynomialFeatures(degree=degree)
+    x_poly = polynomial_features.fit_transform(pd.DataFrame(x))
+    model = LinearRegression()
+    model.fit(x_poly, y)
+    return root_mean_squared_error(y,model.predict(x_poly))
+
+def best_degree(x, y):
+    degree_list=range(1,15)
+    rmse_list=[degree_choice(x,y,degree) for degree in degree_list]
+    return degree_list[min(range(len(rmse_list)), key=rmse_list.__getitem__)]
+
+def legacy_compute_models(training_dict : dict, exclude_beyond : int = None):
+    model_dict = {}
+    for level, dataset in training_dict.items():
+        clean_training = dataset.dropna()
+        if exclude_beyond is not None:
+            clean_training = clean_training.loc[clean_training['cpu%_package-global'] <= exclude_beyond]
+        x = clean_training['cpu%_package-global']
+        y = clean_training['package-global-watt']
+        degree = best_degree(x, y)
+        x_poly = PolynomialFeatures(degree=degree).fit_transform(pd.DataFrame(x))
+        reg = LinearRegression().fit(x_poly, y)
+        model_dict[level] = (degree, root_mean_squared_error(y, reg.predict(x_poly)))
+    return model_dict
+
+###########################################
+# Benchmark
+###########################################
+def bench_host(name : str, pattern : str, core_host : int):
+    training_dict = load_training(pattern)
+    exclude_beyond = (VM_SIZE * 100) / core_host * 3
+
+    begin = time.perf_counter()
+    legacy = legacy_compute_models(training_dict=training_dict, exclude_beyond=exclude_beyond)
+    legacy_duration = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    models = compute_models(training_dict=training_dict, exclude_beyond=exclude_beyond)
+    duration = time.perf_counter() - begin
+
+    print(name, 'legacy', round(legacy_duration, 3), 's', 'engine', round(duration, 3), 's', 'speedup', round(legacy_duration/duration, 1))
+    for level in training_dict.keys():
+        print(' ', level, '- legacy degree', legacy[level][0], 'RMSE', round(legacy[level][1], 3),
+              '| engine degree', models[level].degree, 'RMSE', round(models[level].stats['rmse'], 3), 'CV-RMSE', round(models[level].stats['cv_rmse'], 3))
+
+if __name__ == '__main__':
+
+    root  = '.'
+    hosts = list(REFERENCE_HOSTS.keys())
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'hr:', ['help', 'root=', 'host='])
+    except getopt.error as err:
+        print(str(err))
+        print_usage()
+        sys.exit(-1)
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            print_usage()
+            sys.exit(0)
+        elif current_argument in ('-r', '--root'):
+            root = current_value
+        elif current_argument == '--host':
+            hosts = current_value.split(',')
+
+    for name in hosts:
+        pattern, core_host = REFERENCE_HOSTS[name]
+        pattern = join(root, pattern)
+        if not exists(pattern.replace('XXX', 'training-50')):
+            print(name, 'skipped, no data in', root)
+            continue
+        bench_host(name=name, pattern=pattern, core_host=core_host)
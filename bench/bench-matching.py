@@ -0,0 +1,68 @@
+import sys, getopt, time
+from os.path import dirname, abspath, join, exists
+sys.path.insert(0, join(dirname(abspath(__file__)), '..'))
+import numpy as np
+from cinergy.loader import REFERENCE_HOSTS, load_dataset
+from cinergy.evaluation import match_closest
+
+def print_usage():
+    print('python3 bench/bench-matching.py [--help] [--root=. (folder where data.tar.gz was extracted)] [--host=nova,grappe,...]')
+
+###########################################
+# Former notebook implementation (argsort per row, one-sided threshold)
+###########################################
+def get_closest_val(source_df, col, row, val, threshold = 0.001):
+    sorted_df = source_df.iloc[(source_df[col]-row[col]).abs().argsort()]
+    if (sorted_df['host_percent_vm'].iloc[0] - row[col]) > threshold:
+        return np.nan
+    return sorted_df.iloc[0][val]
+
+###########################################
+# Benchmark
+###########################################
+def bench_host(name : str, pattern : str, core_host : int):
+    groundtruth = load_dataset(pattern.replace('XXX', 'groundtruth')).dropna()
+    groundtruth = groundtruth.assign(host_percent_vm = groundtruth.vm / core_host)
+    cloudlike = load_dataset(pattern.replace('XXX', 'cloudlike')).dropna()
+    cloudlike = cloudlike.assign(host_percent_vm = cloudlike.vm / core_host)
+
+    begin = time.perf_counter()
+    legacy = cloudlike.apply(lambda row : get_closest_val(groundtruth, 'host_percent_vm', row, 'package-global-watt'), axis=1).to_numpy()
+    legacy_duration = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    matched = match_closest(groundtruth, 'host_percent_vm', cloudlike, 'package-global-watt')
+    duration = time.perf_counter() - begin
+
+    both = ~np.isnan(legacy) & ~np.isnan(matched)
+    print(name, len(cloudlike), 'x', len(groundtruth), 'rows', 'legacy', round(legacy_duration, 3), 's', 'matcher', round(duration, 4), 's',
+          'speedup', round(legacy_duration/duration, 1))
+    print(' ', 'matched legacy', int((~np.isnan(legacy)).sum()), 'matcher', int((~np.isnan(matched)).sum()), '(symmetric tolerance)',
+          'identical pairs', bool(np.array_equal(legacy[both], matched[both])))
+
+if __name__ == '__main__':
+
+    root  = '.'
+    hosts = list(REFERENCE_HOSTS.keys())
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'hr:', ['help', 'root=', 'host='])
+    except getopt.error as err:
+        print(str(err))
+        print_usage()
+        sys.exit(-1)
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            print_usage()
+            sys.exit(0)
+        elif current_argument in ('-r', '--root'):
+            root = current_value
+        elif current_argument == '--host':
+            hosts = current_value.split(',')
+
+    for name in hosts:
+        pattern, core_host = REFERENCE_HOSTS[name]
+        pattern = join(root, pattern)
+        if not exists(pattern.replace('XXX', 'groundtruth')):
+            print(name, 'skipped, no data in', root)
+            continue
+        bench_host(name=name, pattern=pattern, core_host=core_host)
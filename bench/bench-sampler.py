@@ -0,0 +1,123 @@
+import sys, getopt, time, tempfile, tracemalloc, contextlib, io, importlib.util
+from os.path import dirname, abspath, join
+sys.path.insert(0, dirname(abspath(__file__)))
+import numpy as np
+from fixtures import Fixture, use_fixture
+
+def print_usage():
+    print('python3 bench/bench-sampler.py [--help] [--cpus=8,64,256,512] [--sockets=2] [--smt=2] [--vm=4] [--vcpu=4] [--tick=50 (measured ticks per shape)] [--range=' + str(2**32) + ' (uJ, RAPL wraparound, above RAPL_MAX_POWER x 1s simulated tick)] [--cache] [--cgroup (VMs accounted from cgroups)]')
+
+def load_sampler():
+    """cinergy-model.py is a script (not importable by name): load it as a module"""
+    spec = importlib.util.spec_from_file_location('cinergy_model', join(dirname(abspath(__file__)), '..', 'cinergy-model.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def reset_sampler(sampler, root : str):
+    """Drop readers and histories opened on a previous fixture"""
+    for reader in [sampler.rapl_reader, sampler.freq_reader]:
+        if reader is not None: reader.close()
+    sampler.rapl_reader, sampler.freq_reader, sampler.overhead = None, None, None
+    sampler.cache_domains, sampler.vm_cgroups = None, None
+    sampler.process_hist_dict.clear()
+    sampler.OUTPUT_PREFIX = join(root, 'consumption')
+    sampler.LIVE_DISPLAY  = False
+
+def timed(function, **kwargs):
+    begin = time.perf_counter_ns()
+    result = function(**kwargs)
+    return result, time.perf_counter_ns() - begin
+
+###########################################
+# Benchmark
+###########################################
+def bench_shape(sampler, cpus : int, sockets : int, smt : int, vm : int, vcpu : int, ticks : int, rapl_range : int, cgroup : bool):
+    with tempfile.TemporaryDirectory() as root:
+        fixture = Fixture(root=root, sockets=sockets, cores=cpus//(sockets*smt), smt=smt, vm=vm, vcpu=vcpu, rapl_range=rapl_range, cgroup=cgroup)
+        use_fixture(sampler, fixture)
+        reset_sampler(sampler, root)
+        sampler.CLOCK = fixture.clock # Deltas are divided by the simulated interval, not by the real duration of a tick
+
+        durations = dict()
+        rapl_sysfs, durations['find_rapl_sysfs']        = timed(sampler.find_rapl_sysfs)
+        topology, durations['find_topology (discovery)'] = timed(sampler.find_topology)
+        topology, durations['find_topology (snapshot)']  = timed(sampler.find_topology)
+        cpuid_per_numa, cache_topo = topology.cpuid_per_numa(), topology.cache_topo()
+
+        scanner = sampler.ProcessScanner(keyword='qemu')
+        _, durations['monitor_process (first)'] = timed(sampler.monitor_process, scanner=scanner, output_dict={})
+        monitor_process = list()
+        for _ in range(ticks):
+            fixture.advance(duration=1)
+            monitor_process.append(timed(sampler.monitor_process, scanner=scanner, output_dict={})[1])
+
+        parameters = {'label': 'bench', 'rapl_sysfs': rapl_sysfs, 'cpuid_per_numa': cpuid_per_numa, 'cache_topo': cache_topo, 'misc': {'phase': 'bench'}}
+        with contextlib.redirect_stdout(io.StringIO()): # overhead summary of the sampler
+            _, durations['read_system (first)'] = timed(sampler.read_system, init=True, **parameters)
+            consumed = dict(fixture.consumed)
+            read_system = list()
+            for _ in range(ticks):
+                fixture.advance(duration=1)
+                read_system.append(timed(sampler.read_system, **parameters)[1])
+
+            # Allocations of a tick, measured apart as tracing slows everything down
+            tracemalloc.start()
+            allocated = list()
+            for _ in range(ticks):
+                fixture.advance(duration=1)
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                sampler.read_system(**parameters)
+                allocated.append(tracemalloc.get_traced_memory()[1] - before)
+            retained = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            sampler.close_output()
+
+        # Energy rebuilt across wraparounds against the energy really consumed by the fake host
+        energy_error = 0
+        for domain, path in rapl_sysfs.items():
+            zone = path.split('/')[-2]
+            energy_error = max(energy_error, abs(sampler.rapl_hist['total'].get(domain, 0) - (fixture.consumed[zone] - consumed[zone])))
+
+    print(cpus, 'cpus', sockets, 'socket(s)', vm, 'vm(s) of', vcpu, 'vcpus', '-', fixture.wraps, 'RAPL wraparound(s), energy error', round(energy_error/10**6, 6), 'J')
+    for name, duration in durations.items(): print(' ', name.ljust(25), round(duration/10**6, 3), 'ms')
+    for name, values in [('monitor_process', monitor_process), ('read_system tick', read_system)]:
+        print(' ', name.ljust(25), 'p50', round(np.percentile(values, 50)/10**6, 3), 'ms', 'p95', round(np.percentile(values, 95)/10**6, 3), 'ms')
+    print(' ', 'read_system allocations'.ljust(25), 'peak', round(np.median(allocated)/1024, 1), 'KiB per tick', 'traced after run', round(retained/1024, 1), 'KiB')
+
+if __name__ == '__main__':
+
+    cpus  = [8, 64, 256, 512]
+    shape = {'sockets': 2, 'smt': 2, 'vm': 4, 'vcpu': 4, 'ticks': 50, 'rapl_range': 2**32, 'cgroup': False}
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'h', ['help', 'cpus=', 'sockets=', 'smt=', 'vm=', 'vcpu=', 'tick=', 'range=', 'cache', 'cgroup'])
+    except getopt.error as err:
+        print(str(err))
+        print_usage()
+        sys.exit(-1)
+    per_cache_usage = False
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            print_usage()
+            sys.exit(0)
+        elif current_argument == '--cache':
+            per_cache_usage = True
+        elif current_argument == '--cgroup':
+            shape['cgroup'] = True
+        elif current_argument == '--cpus':
+            cpus = [int(value) for value in current_value.split(',')]
+        elif current_argument == '--tick':
+            shape['ticks'] = int(current_value)
+        elif current_argument == '--range':
+            shape['rapl_range'] = int(current_value)
+        else:
+            shape[current_argument[2:]] = int(current_value)
+
+    sampler = load_sampler()
+    sampler.PER_CACHE_USAGE = per_cache_usage
+    for count in cpus:
+        if count % (shape['sockets']*shape['smt']) != 0:
+            print('Skipping', count, 'cpus: not a multiple of sockets x smt')
+            continue
+        bench_shape(sampler=sampler, cpus=count, **shape)
@@ -0,0 +1,231 @@
+import sys, getopt, os
+from os.path import join
+import numpy as np
+
+# Paths of a fixture, relative to its root, for each global of cinergy-model.py reading the kernel
+FIXTURE_PATHS = {'ROOT_FS': 'powercap/', 'SYSFS_STAT': 'proc/stat', 'SYSFS_TOPO': 'cpu/', 'SYSFS_FREQ': 'cpu/{core}/cpufreq/scaling_cur_freq',
+                 'SYSFS_ONLINE': 'cpu/online', 'SYSFS_NODE': 'node/', 'PROCFS': 'proc/', 'CGROUP_ROOT': 'cgroup/',
+                 'TOPOLOGY_SNAPSHOT': 'topology-{host}.json'}
+RAPL_RANGE = 262143328850 # max_energy_range_uj of most Intel packages
+FIRST_PID  = 1000
+
+def print_usage():
+    print('python3 bench/fixtures.py [--help] --root=/tmp/fake-host [--sockets=1 (1-8)] [--cores=4 (per socket)] [--smt=2] [--vm=0] [--vcpu=2 (per vm)] [--range=' + str(RAPL_RANGE) + ' (uJ, RAPL wraparound)] [--cgroup (libvirt machine.slice)]')
+
+def range_list(cpus : list):
+    """Format cpu ids as a kernel range list (e.g. 0-3,8-11)"""
+    ranges, cpus = list(), sorted(cpus)
+    begin = prev = cpus[0]
+    for cpu in cpus[1:] + [None]:
+        if cpu is not None and cpu == prev + 1:
+            prev = cpu
+            continue
+        ranges.append(str(begin) if begin == prev else str(begin) + '-' + str(prev))
+        begin = prev = cpu
+    return ','.join(ranges)
+
+def write(path : str, content):
+    with open(path, 'w') as f: # Same inode is kept: persistent readers see the new content
+        f.write(str(content) + '\n')
+
+###########################################
+# Fake host
+###########################################
+
+class Fixture(object):
+    """Fake powercap, cpu topology, cache hierarchy and /proc tree of a host with sockets x cores x smt cpus (numbered as
+    Linux does: siblings of cpu X are X + k*sockets*cores) and vm QEMU processes of vcpu threads each. advance() moves
+    every counter forward as if duration seconds elapsed, RAPL counters wrap at rapl_range. With cgroup, VMs are placed
+    in a cgroup v2 machine.slice scope with one sub-cgroup per vCPU, as libvirt does"""
+
+    def __init__(self, root : str, sockets : int = 1, cores : int = 4, smt : int = 2, vm : int = 0, vcpu : int = 2, rapl_range : int = RAPL_RANGE, seed : int = 0, cgroup : bool = False):
+        self.root, self.sockets, self.cores, self.smt = root, sockets, cores, smt
+        self.rapl_range = rapl_range
+        self.rng = np.random.default_rng(seed)
+        self.cpus = sockets * cores * smt
+        self.counters = np.zeros((self.cpus, 10), dtype=np.int64) # /proc/stat fields, in jiffies
+        self.energy = {} # rapl zone -> uJ (counter)
+        self.consumed = {} # rapl zone -> uJ consumed since creation (no wrap)
+        self.wraps = 0
+        self.time_ns = 10**9 # Simulated CLOCK_MONOTONIC, moved by advance()
+        self.threads = {} # tid -> schedstat cpu time (ns)
+        self.vms = {} # pid -> list of vcpu tids
+        self.scopes = {} # pid -> cgroup scope folder
+        self.cgroup = cgroup
+        for path in [join(root, 'powercap'), join(root, 'cpu'), join(root, 'node'), join(root, 'proc')]: os.makedirs(path, exist_ok=True)
+        self.__build_powercap()
+        self.__build_topology()
+        self.__build_proc(vm=vm, vcpu=vcpu)
+        self.advance(duration=0)
+
+    def paths(self):
+        """Value of each path global of cinergy-model.py for this fixture"""
+        return {name: join(self.root, path) for name, path in FIXTURE_PATHS.items()}
+
+    def clock(self):
+        """Replacement of the sampler CLOCK: time only moves with advance(), whatever the real duration of a tick"""
+        return self.time_ns
+
+    def socket_of(self, cpu : int):
+        return (cpu % (self.sockets*self.cores)) // self.cores
+
+    def siblings_of(self, cpu : int):
+        first = cpu % (self.sockets*self.cores)
+        return [first + thread*self.sockets*self.cores for thread in range(self.smt)]
+
+    def __build_powercap(self):
+        for socket in range(self.sockets):
+            zones = {'intel-rapl:' + str(socket): 'package-' + str(socket), 'intel-rapl:' + str(socket) + ':0': 'dram'}
+            for zone, name in zones.items():
+                os.makedirs(join(self.root, 'powercap', zone), exist_ok=True)
+                write(join(self.root, 'powercap', zone, 'name'), name)
+                write(join(self.root, 'powercap', zone, 'max_energy_range_uj'), self.rapl_range)
+                self.energy[zone] = int(self.rng.integers(0, self.rapl_range))
+                self.consumed[zone] = 0
+
+    def __build_topology(self):
+        write(join(self.root, 'cpu', 'online'), range_list(list(range(self.cpus))))
+        write(join(self.root, 'cpu', 'present'), range_list(list(range(self.cpus))))
+        write(join(self.root, 'node', 'online'), range_list(list(range(self.sockets))))
+        for socket in range(self.sockets): # One NUMA node per socket
+            os.makedirs(join(self.root, 'node', 'node' + str(socket)), exist_ok=True)
+            write(join(self.root, 'node', 'node' + str(socket), 'cpulist'), range_list([cpu for cpu in range(self.cpus) if self.socket_of(cpu) == socket]))
+        for cpu in range(self.cpus):
+            base = join(self.root, 'cpu', 'cpu' + str(cpu))
+            socket, siblings = self.socket_of(cpu), self.siblings_of(cpu)
+            for folder in ['topology', 'cpufreq']: os.makedirs(join(base, folder), exist_ok=True)
+            write(join(base, 'topology', 'physical_package_id'), socket)
+            write(join(base, 'topology', 'core_id'), cpu % self.cores)
+            write(join(base, 'topology', 'thread_siblings_list'), range_list(siblings))
+            socket_cpus = [other for other in range(self.cpus) if self.socket_of(other) == socket]
+            write(join(base, 'topology', 'package_cpus_list'), range_list(socket_cpus))
+            # index0: L1d, index1: L1i, index2: L2 (per core), index3: L3 (per socket)
+            caches = [(1, 'Data', siblings[0], siblings), (1, 'Instruction', siblings[0], siblings), (2, 'Unified', siblings[0], siblings),
+                      (3, 'Unified', socket, socket_cpus)]
+            for index, (level, kind, cache_id, shared) in enumerate(caches):
+                folder = join(base, 'cache', 'index' + str(index))
+                os.makedirs(folder, exist_ok=True)
+                write(join(folder, 'level'), level)
+                write(join(folder, 'type'), kind)
+                write(join(folder, 'id'), cache_id)
+                write(join(folder, 'shared_cpu_list'), range_list(shared))
+
+    def __build_proc(self, vm : int, vcpu : int):
+        pid = FIRST_PID
+        for name in ['systemd', 'sshd', 'bash']: # processes the scanner has to ignore
+            self.__build_pid(pid=pid, comm=name, cmdline=[name])
+            pid+=1
+        for index in range(vm):
+            cmdline = ['qemu-system-x86_64', '-name', 'guest=vm' + str(index) + ',debug-threads=on', '-smp', str(vcpu)]
+            self.__build_pid(pid=pid, comm='qemu-system-x86', cmdline=cmdline)
+            self.vms[pid] = list()
+            if self.cgroup: self.__build_scope(pid=pid, index=index, vcpu=vcpu)
+            for thread in range(vcpu + 2): # vcpu threads plus the main and an I/O thread
+                tid = pid + 1 + thread
+                comm = 'CPU ' + str(thread) + '/KVM' if thread < vcpu else 'IO mon_iothread'
+                if thread < vcpu: self.vms[pid].append(tid)
+                self.__build_task(pid=pid, tid=tid, comm=comm)
+            pid+= vcpu + 3
+
+    def __build_scope(self, pid : int, index : int, vcpu : int):
+        scope = join('machine.slice', 'machine-qemu\\x2d' + str(index+1) + '\\x2dvm' + str(index) + '.scope')
+        for folder in ['libvirt/emulator'] + ['libvirt/vcpu' + str(thread) for thread in range(vcpu)]:
+            os.makedirs(join(self.root, 'cgroup', scope, folder), exist_ok=True)
+        write(join(self.root, 'cgroup', 'cgroup.controllers'), 'cpuset cpu io memory pids')
+        write(join(self.root, 'proc', str(pid), 'cgroup'), '0::/' + scope + '/libvirt/emulator')
+        self.scopes[pid] = join(self.root, 'cgroup', scope)
+
+    def __build_pid(self, pid : int, comm : str, cmdline : list):
+        base = join(self.root, 'proc', str(pid))
+        os.makedirs(join(base, 'task'), exist_ok=True)
+        write(join(base, 'comm'), comm)
+        with open(join(base, 'cmdline'), 'w') as f: f.write('\0'.join(cmdline) + '\0')
+        self.__build_task(pid=pid, tid=pid, comm=comm)
+
+    def __build_task(self, pid : int, tid : int, comm : str):
+        base = join(self.root, 'proc', str(pid), 'task', str(tid))
+        os.makedirs(base, exist_ok=True)
+        write(join(base, 'comm'), comm)
+        if tid != pid: # Threads are also reachable from /proc/<tid>, as on Linux
+            os.makedirs(join(self.root, 'proc', str(tid)), exist_ok=True)
+            write(join(self.root, 'proc', str(tid), 'comm'), comm)
+        self.threads[tid] = (pid, comm, 0)
+
+    def advance(self, duration : float = 1, load : float = None):
+        """Move all counters forward as if duration seconds elapsed with a cpu load (random if None, in [0;1])"""
+        self.time_ns+= int(duration*10**9)
+        usage = self.rng.uniform(0, 1, self.cpus) if load is None else np.full(self.cpus, load)
+        jiffies = int(duration*100)
+        busy = (usage * jiffies).astype(np.int64)
+        self.counters[:, 0] += busy # user
+        self.counters[:, 3] += jiffies - busy # idle
+        for zone in self.energy.keys():
+            watt = 20 + 80*float(usage.mean()) if zone.count(':') == 1 else 5
+            energy = self.energy[zone] + int(watt*duration*10**6)
+            self.wraps+= energy // self.rapl_range
+            self.energy[zone] = energy % self.rapl_range
+            self.consumed[zone]+= int(watt*duration*10**6)
+        for tid, (pid, comm, cputime) in self.threads.items():
+            self.threads[tid] = (pid, comm, cputime + int(float(usage.mean())*duration*10**9))
+        self.__dump(usage=usage)
+
+    def __dump(self, usage : np.ndarray):
+        lines = ['cpu  ' + ' '.join(map(str, self.counters.sum(axis=0)))]
+        lines.extend(['cpu' + str(cpu) + ' ' + ' '.join(map(str, row)) for cpu, row in enumerate(self.counters)])
+        lines.extend(['intr 0', 'ctxt 0', 'btime 0', 'processes ' + str(len(self.threads)), 'procs_running 1', 'procs_blocked 0'])
+        with open(join(self.root, 'proc', 'stat'), 'w') as f: f.write('\n'.join(lines) + '\n')
+        for zone, energy in self.energy.items(): write(join(self.root, 'powercap', zone, 'energy_uj'), energy)
+        for cpu in range(self.cpus): write(join(self.root, 'cpu', 'cpu' + str(cpu), 'cpufreq', 'scaling_cur_freq'), int(800000 + usage[cpu]*2400000))
+        for tid, (pid, comm, cputime) in self.threads.items():
+            stat = str(tid) + ' (' + comm + ') S 1 ' + str(pid) + ' ' + str(pid) + ' 0 -1 4194560 0 0 0 0 ' + str(cputime//10**7) + ' 0 ' + ' '.join(['0']*36)
+            schedstat = str(cputime) + ' 0 0'
+            folders = [join(self.root, 'proc', str(pid), 'task', str(tid)), join(self.root, 'proc', str(tid))]
+            for folder in folders:
+                write(join(folder, 'stat'), stat)
+                write(join(folder, 'schedstat'), schedstat)
+        for pid, scope in self.scopes.items(): # usage of a VM is the sum of its threads
+            threads = [cputime for tid, (parent, _, cputime) in self.threads.items() if parent == pid]
+            write(join(scope, 'cpu.stat'), self.__cpu_stat(sum(threads)))
+            for thread, tid in enumerate(self.vms[pid]):
+                write(join(scope, 'libvirt', 'vcpu' + str(thread), 'cpu.stat'), self.__cpu_stat(self.threads[tid][2]))
+
+    def __cpu_stat(self, cputime : int):
+        usage = cputime // 1000 # ns to us
+        return 'usage_usec ' + str(usage) + '\nuser_usec ' + str(usage*9//10) + '\nsystem_usec ' + str(usage - usage*9//10) + '\nnr_periods 0\nnr_throttled 0\nthrottled_usec 0'
+
+def use_fixture(module, fixture : Fixture):
+    """Redirect every kernel path global of a loaded cinergy-model.py module to the fixture"""
+    for name, path in fixture.paths().items(): setattr(module, name, path)
+
+if __name__ == '__main__':
+
+    root = None
+    shape = {'sockets': 1, 'cores': 4, 'smt': 2, 'vm': 0, 'vcpu': 2, 'rapl_range': RAPL_RANGE}
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'hr:', ['help', 'root=', 'sockets=', 'cores=', 'smt=', 'vm=', 'vcpu=', 'range=', 'cgroup'])
+    except getopt.error as err:
+        print(str(err))
+        print_usage()
+        sys.exit(-1)
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            print_usage()
+            sys.exit(0)
+        elif current_argument in ('-r', '--root'):
+            root = current_value
+        elif current_argument == '--range':
+            shape['rapl_range'] = int(current_value)
+        elif current_argument == '--cgroup':
+            shape['cgroup'] = True
+        else:
+            shape[current_argument[2:]] = int(current_value)
+
+    if root is None:
+        print_usage()
+        sys.exit(-1)
+    if not 1 <= shape['sockets'] <= 8:
+        print('Between 1 and 8 sockets are supported')
+        sys.exit(-1)
+    fixture = Fixture(root=root, **shape)
+    print('Fake host of', fixture.cpus, 'cpus and', len(fixture.vms), 'vm(s) built in', root)
+    for name, path in fixture.paths().items(): print(' ', name.ljust(12), path)
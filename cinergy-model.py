@@ -1,29 +1,63 @@
-import sys, getopt, re, time
-from os import listdir, kill, killpg, getpgid, setsid, remove
-from os.path import isfile, join, exists
-import subprocess, signal
+import sys, getopt, re, time, json
+from os import listdir, kill, setsid, remove, cpu_count, O_RDONLY
+import os
+from os.path import join, exists, basename, dirname
+import subprocess, signal, glob, threading, multiprocessing, atexit, collections, warnings
+import numpy as np
 
 OUTPUT_PREFIX   = 'consumption'
 OUTPUT_HEADER = 'timestamp,domain,measure'
 OUTPUT_NL     = '\n'
+OUTPUT_FORMAT = 'csv' # csv: long format, npz: wide columnar chunks
+OUTPUT_FLUSH_DELAY = 10   # s, at most this much data is lost on a crash
+OUTPUT_FLUSH_SIZE  = 5000 # buffered records before a forced flush
 ROOT_FS       ='/sys/class/powercap/'
 PRECISION     = 2
 SYSFS_STAT    = '/proc/stat'
 SYSFS_TOPO    = '/sys/devices/system/cpu/'
 SYSFS_FREQ    = '/sys/devices/system/cpu/{core}/cpufreq/scaling_cur_freq'
+SYSFS_ONLINE  = '/sys/devices/system/cpu/online'
+SYSFS_NODE    = '/sys/devices/system/node/'
+TOPOLOGY_SNAPSHOT = join(os.path.expanduser('~'), '.cache', 'cinergy-topology-{host}.json') # None: always discover. One per host (shared homes)
+TOPOLOGY_RESCAN   = False # Discover even if the snapshot matches the host
+PROCFS        = '/proc/'
+CLOCK         = time.monotonic_ns # ns, time of the measures (CLOCK_MONOTONIC: not affected by NTP steps)
+CGROUP_ROOT   = '/sys/fs/cgroup/' # cgroup v2 unified hierarchy
+VCPU_DETAIL   = True # Usage of each vCPU of VMs accounted by cgroups (one more read per vCPU)
+RAPL_MAX_POWER = 1000 # W, upper bound of a domain power: beyond range/RAPL_MAX_POWER between reads, several wraps are possible
+SYSFS_BUFFER  = 64 # bytes, initial size of read buffers (enough for counters, grown for longer files such as cpu lists)
 # From https://www.kernel.org/doc/Documentation/filesystems/proc.txt
 SYSFS_STATS_KEYS  = {'cpuid':0, 'user':1, 'nice':2 , 'system':3, 'idle':4, 'iowait':5, 'irq':6, 'softirq':7, 'steal':8, 'guest':9, 'guest_nice':10}
 SYSFS_STATS_IDLE  = ['idle', 'iowait']
 SYSFS_STATS_NTID  = ['user', 'nice', 'system', 'irq', 'softirq', 'steal']
+SYSFS_STATS_IDLE_IDX = [SYSFS_STATS_KEYS[key]-1 for key in SYSFS_STATS_IDLE] # Column index once the cpuid is removed
+SYSFS_STATS_NTID_IDX = [SYSFS_STATS_KEYS[key]-1 for key in SYSFS_STATS_NTID]
 LIVE_DISPLAY = False
 PER_CACHE_USAGE = None
 VM_CONNECTOR    = None
 MODEL_MEASURE_WINDOW = 2
 MODEL_ITERATION = 10
 MODEL_STEP = [25, 50, 100] # Percentage of load per step
+ESTIMATION_MODEL = None # Online estimation of VM power instead of data generation
+# Adaptive steps: sample a step until the 95% confidence interval of each metric is within tolerance (relative to the
+# mean, or to the full scale when one is given), between ADAPTIVE_MIN and ADAPTIVE_MAX samples. MODEL_ITERATION otherwise
+ADAPTIVE_TOLERANCE = None
+ADAPTIVE_MIN = 3
+ADAPTIVE_MAX = 30
+ADAPTIVE_METRICS = {'package-global-watt': None, 'cpu%_package-global': 100}
+LOAD_PERIOD = 0.1 # s, duty cycle period of the load workers
+LOAD_START_TIMEOUT = 10 # s, for every load worker to be pinned
+SCAN_RECHECK  = 3 # scans during which a process not matching is looked at again: its name changes on exec
+PIPELINE_RING = 1024 # samples buffered between the sampling loop and the slowest consumer
+STORE_CAPACITY = 512  # samples kept in memory per metric for rolling queries
+STORE_METRICS  = 1024 # metrics kept in memory (others are only written)
+STORE_DISPLAY_WINDOW = 10 # s, rolling window of the live display
+RESUME = False # Resume the campaign recorded in the manifest of OUTPUT_PREFIX
+STUDENT_T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+               2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042] # per degree of freedom
 
 def print_usage():
-    print('python3 rapl-reader.py [--help] [--live] [--explicit] [--vm=qemu:///system] [--output=' + OUTPUT_PREFIX + '] [--precision=' + str(PRECISION) + ' (number of decimal)]')
+    print('python3 rapl-reader.py [--help] [--live] [--explicit] [--vm=qemu:///system] [--estimate=models/host.json] [--delay=' + str(MODEL_MEASURE_WINDOW) + ' (s)] [--tolerance=0.01 (adaptive steps)] [--min=' + str(ADAPTIVE_MIN) + '] [--max=' + str(ADAPTIVE_MAX) + ' (samples per adaptive step)] [--resume] [--no-vcpu (cgroup VM usage only)] [--topology=' + str(TOPOLOGY_SNAPSHOT) + ' (snapshot, empty to disable)] [--rescan] [--output=' + OUTPUT_PREFIX + '] [--format=' + OUTPUT_FORMAT + ' (csv|npz)] [--flush=' + str(OUTPUT_FLUSH_DELAY) + ' (s)] [--precision=' + str(PRECISION) + ' (number of decimal)]')
 
 ###########################################
 # Find relevant sysfs
@@ -41,221 +75,436 @@ def find_rapl_sysfs():
         sysfs[domain] = base + '/energy_uj'
     return sysfs
 
-def find_cpuid_per_numa():
-    regex = '^cpu[0-9]+$'
-    cpu_found = [int(re.sub("[^0-9]", '', f)) for f in listdir(SYSFS_TOPO) if not isfile(join('topology', f)) and re.match(regex, f)]
-    cpu_per_numa = dict()
-    for cpu in cpu_found:
-        path = SYSFS_TOPO + 'cpu' + str(cpu) + '/topology/physical_package_id'
-        if not exists(path): continue
-        with open(path, 'r') as f:
-            numa_id = int(f.read())
-        if numa_id not in cpu_per_numa: cpu_per_numa[numa_id] = list()
-        cpu_per_numa[numa_id].append('cpu' + str(cpu))
-    return cpu_per_numa
-
-def find_cache_topo():
-    regex_cpu = '^cpu[0-9]+$'
-    regex_idx = '^index[0-9]+$'
-    cpu_found = [int(re.sub("[^0-9]", '', f)) for f in listdir(SYSFS_TOPO) if re.match(regex_cpu, f)]
-    cpu_per_cache = dict()
-    cpu_found.sort()
-    for cpu in cpu_found:
-        path = SYSFS_TOPO + 'cpu' + str(cpu) + '/cache'
-        cache_found = [int(re.sub("[^0-9]", '', f)) for f in listdir(path) if not isfile(f) and re.match(regex_idx, f)]
-        cache_found.sort()
-        prev_shared = None
-        cache_list_for_cpu = dict()
-        for cache_index in cache_found:
-            path_completed = path + '/' + 'index' + str(cache_index)
-            with open(path_completed + '/shared_cpu_list', 'r') as f:
-                shared = f.read()
-                if shared == prev_shared:
-                    continue
-            with open(path_completed + '/id', 'r') as f:
-                cache_id = int(f.read())
-            cache_list_for_cpu[cache_index] = cache_id
-            prev_shared = shared
-
-        cache_index_of_interest = list(cache_list_for_cpu.keys())
-        cache_index_of_interest.sort(reverse=True)
-        prev_elem = cpu_per_cache
-
-        for cache_index_unique in cache_index_of_interest:
-            key = 'L' + str(cache_index_unique) + '-' + str(cache_list_for_cpu[cache_index_unique])
-            if cache_index_unique != min(cache_index_of_interest):
-                if key not in prev_elem:
-                    prev_elem[key] = dict()
+def find_rapl_range(rapl_sysfs : dict):
+    """Value at which the energy counter of each domain wraps (None if not exposed)"""
+    energy_range = dict()
+    for domain, path in rapl_sysfs.items():
+        try:
+            with open(path.replace('energy_uj', 'max_energy_range_uj'), 'r') as f:
+                energy_range[domain] = int(f.read())
+        except (OSError, ValueError):
+            energy_range[domain] = None
+    return energy_range
+
+def parse_range_list(content : str):
+    """Cpu ids of a kernel range list (e.g. 0-3,8-11)"""
+    cpus = list()
+    for part in content.strip().split(','):
+        if not part: continue
+        if '-' in part:
+            begin, end = part.split('-')
+            cpus.extend(range(int(begin), int(end)+1))
+        else: cpus.append(int(part))
+    return cpus
+
+def read_sysfs_text(*paths : str):
+    """Content of the first readable path (None if none is)"""
+    for path in paths:
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+class Topology(collections.namedtuple('Topology', ['cpus', 'packages', 'cores', 'nodes', 'siblings', 'caches'])):
+    """Immutable cpu topology. packages, cores and nodes give for the cpu of same index in cpus its package id, its
+    physical core (index in siblings, the cpus of each core) and its NUMA node (-1 if unknown). caches lists each cache
+    domain once as (index, level, id, cpus)"""
+    __slots__ = ()
+
+    def cpuid_per_numa(self):
+        cpu_per_numa = dict()
+        for cpu, package in zip(self.cpus, self.packages):
+            if package not in cpu_per_numa: cpu_per_numa[package] = list()
+            cpu_per_numa[package].append('cpu' + str(cpu))
+        return cpu_per_numa
+
+    def cache_topo(self):
+        """Cache hierarchy as nested dicts from the outermost cache to cpu lists (L<index>-<id> keys). Consecutive
+        indexes shared by the same cpus (e.g. L1d, L1i and L2 of a core) are represented by the lowest one"""
+        per_cpu = {cpu: list() for cpu in self.cpus}
+        for cache_index, _, cache_id, cpus in sorted(self.caches):
+            for cpu in cpus: per_cpu[cpu].append((cache_index, cache_id, cpus))
+        cpu_per_cache = dict()
+        for cpu in self.cpus:
+            kept, prev_shared = list(), None
+            for cache_index, cache_id, cpus in per_cpu[cpu]:
+                if cpus != prev_shared: kept.append('L' + str(cache_index) + '-' + str(cache_id))
+                prev_shared = cpus
+            prev_elem = cpu_per_cache
+            for key in reversed(kept[1:]):
+                if key not in prev_elem: prev_elem[key] = dict()
                 prev_elem = prev_elem[key]
-            else:
-                if key not in prev_elem:
-                    prev_elem[key] = list()
-                prev_elem[key].append(cpu)
-                break
+            if kept:
+                if kept[0] not in prev_elem: prev_elem[kept[0]] = list()
+                prev_elem[kept[0]].append(cpu)
+        return cpu_per_cache
+
+    def to_json(self):
+        return self._asdict()
+
+    @staticmethod
+    def from_json(content : dict):
+        return Topology(cpus=tuple(content['cpus']), packages=tuple(content['packages']), cores=tuple(content['cores']),
+                        nodes=tuple(content['nodes']), siblings=tuple(tuple(cpus) for cpus in content['siblings']),
+                        caches=tuple((cache_index, level, cache_id, tuple(cpus)) for cache_index, level, cache_id, cpus in content['caches']))
+
+def discover_topology():
+    """Walk sysfs once: a package, core or cache shared by several cpus is read from its first cpu only, its range list
+    gives the other ones"""
+    online_content = read_sysfs_text(SYSFS_ONLINE)
+    if online_content is not None: online = parse_range_list(online_content)
+    else: online = sorted(int(f[3:]) for f in listdir(SYSFS_TOPO) if re.match('^cpu[0-9]+$', f))
+    online_set = set(online)
+
+    package = dict()
+    for cpu in online:
+        if cpu in package: continue
+        base = SYSFS_TOPO + 'cpu' + str(cpu) + '/topology/'
+        package_id = read_sysfs_text(base + 'physical_package_id')
+        if package_id is None: continue # No topology, e.g. cpu going offline
+        members = read_sysfs_text(base + 'package_cpus_list', base + 'core_siblings_list')
+        for member in (parse_range_list(members) if members is not None else [cpu]):
+            if member in online_set: package[member] = int(package_id)
+        package[cpu] = int(package_id)
+    cpus = sorted(package.keys())
+
+    core, siblings = dict(), list()
+    for cpu in cpus:
+        if cpu in core: continue
+        base = SYSFS_TOPO + 'cpu' + str(cpu) + '/topology/'
+        members = read_sysfs_text(base + 'core_cpus_list', base + 'thread_siblings_list')
+        members = [member for member in (parse_range_list(members) if members is not None else [cpu]) if member in package and member not in core]
+        if cpu not in members: members = [cpu] + members
+        for member in members: core[member] = len(siblings)
+        siblings.append(tuple(sorted(members)))
+
+    node = dict()
+    for folder in glob.glob(SYSFS_NODE + 'node[0-9]*'):
+        members = read_sysfs_text(join(folder, 'cpulist'))
+        if members is None: continue
+        for member in parse_range_list(members): node[member] = int(basename(folder)[4:])
+
+    caches = list()
+    cache_path = SYSFS_TOPO + 'cpu' + str(cpus[0]) + '/cache' if cpus else None
+    cache_indexes = sorted(int(f[5:]) for f in listdir(cache_path) if re.match('^index[0-9]+$', f)) if cache_path and exists(cache_path) else list()
+    for cache_index in cache_indexes:
+        covered, level = set(), read_sysfs_text(cache_path + '/index' + str(cache_index) + '/level') # Same level on every cpu
+        for cpu in cpus:
+            if cpu in covered: continue
+            base = SYSFS_TOPO + 'cpu' + str(cpu) + '/cache/index' + str(cache_index) + '/'
+            members = read_sysfs_text(base + 'shared_cpu_list')
+            if members is None: continue # Hybrid cpus may not have every index
+            members = sorted(set(member for member in parse_range_list(members) if member in package) | {cpu})
+            cache_id = read_sysfs_text(base + 'id')
+            cache_id = int(cache_id) if cache_id is not None else members[0] # id is not exposed by every architecture
+            caches.append((cache_index, int(level) if level is not None else None, cache_id, tuple(members)))
+            covered.update(members)
+
+    return Topology(cpus=tuple(cpus), packages=tuple(package[cpu] for cpu in cpus), cores=tuple(core[cpu] for cpu in cpus),
+                    nodes=tuple(node.get(cpu, -1) for cpu in cpus), siblings=tuple(siblings), caches=tuple(caches))
+
+def topology_fingerprint():
+    """Cheap description of the host and kernel: a topology snapshot is only valid on an identical one"""
+    return {'kernel': list(os.uname()), 'sysfs': SYSFS_TOPO, 'online': read_sysfs_text(SYSFS_ONLINE),
+            'present': read_sysfs_text(SYSFS_TOPO + 'present'), 'nodes': read_sysfs_text(SYSFS_NODE + 'online')}
+
+def find_topology():
+    """Topology from the snapshot if it was taken on this host and kernel, discovered (and snapshotted) otherwise"""
+    fingerprint = topology_fingerprint()
+    snapshot_path = TOPOLOGY_SNAPSHOT.replace('{host}', os.uname().nodename) if TOPOLOGY_SNAPSHOT else None
+    if snapshot_path and not TOPOLOGY_RESCAN and exists(snapshot_path):
+        try:
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot['fingerprint'] == fingerprint: return Topology.from_json(snapshot['topology'])
+        except (OSError, ValueError, KeyError, TypeError): # Corrupted snapshot: discover again
+            pass
+    topology = discover_topology()
+    if snapshot_path:
+        try:
+            os.makedirs(dirname(snapshot_path) or '.', exist_ok=True)
+            with open(snapshot_path + '.tmp', 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'topology': topology.to_json()}, f)
+            os.replace(snapshot_path + '.tmp', snapshot_path)
+        except OSError as err:
+            print('Warning: topology snapshot', snapshot_path, 'not saved:', err)
+    return topology
 
-    return cpu_per_cache
+###########################################
+# Persistent sysfs readers
+###########################################
+class SysfsReader(object):
+    """Open a set of sysfs files once and re-read them at offset 0 into preallocated buffers on each batch.
+    If a watch file is given (e.g. the online cpu list), files are re-opened only when its content changes"""
+
+    def __init__(self, paths : dict, watch : str = None):
+        self.paths   = paths
+        self.watch   = watch
+        self.fds     = dict()
+        self.buffers = dict()
+        self.watch_fd, self.watch_content = None, None
+        self.last_batch_ns = 0
+        self.reopen_needed = False
+        if watch is not None:
+            self.watch_fd = os.open(watch, O_RDONLY)
+            self.watch_buffer = bytearray(SYSFS_BUFFER)
+            self.watch_content = self.__pread(self.watch_fd, self.watch_buffer)
+        self.open()
+
+    def open(self):
+        self.close_files()
+        for name, path in self.paths.items():
+            try:
+                self.fds[name] = os.open(path, O_RDONLY)
+            except OSError: # Offline cpu, missing driver...
+                continue
+            self.buffers[name] = bytearray(SYSFS_BUFFER)
+        self.reopen_needed = False
+
+    def __pread(self, fd : int, buffer : bytearray):
+        size = os.preadv(fd, [buffer], 0)
+        while size == len(buffer): # May be truncated (e.g. online list of cpus offlined one by one): grow and re-read
+            buffer.extend(bytes(len(buffer)))
+            size = os.preadv(fd, [buffer], 0)
+        return bytes(buffer[:size])
+
+    def __has_hotplug(self):
+        if self.watch_fd is None: return False
+        content = self.__pread(self.watch_fd, self.watch_buffer)
+        changed = content != self.watch_content
+        self.watch_content = content
+        return changed
+
+    def read(self):
+        """Return the integer value of each file (None if unreadable), batch duration is kept in last_batch_ns"""
+        begin = time.perf_counter_ns()
+        if self.reopen_needed or self.__has_hotplug(): self.open()
+        values = dict()
+        for name, fd in self.fds.items():
+            try:
+                values[name] = int(self.__pread(fd, self.buffers[name]))
+            except (OSError, ValueError): # cpu went offline during the batch: re-open on next one
+                values[name] = None
+                self.reopen_needed = True
+        self.last_batch_ns = time.perf_counter_ns() - begin
+        return values
+
+    def close_files(self):
+        for fd in self.fds.values(): os.close(fd)
+        self.fds, self.buffers = dict(), dict()
+
+    def close(self):
+        self.close_files()
+        if self.watch_fd is not None: os.close(self.watch_fd)
+        self.watch_fd = None
 
 ###########################################
 # Read CPU usage
 ###########################################
-def read_cpu_usage(cpuid_per_numa : dict, hist :dict):
+def read_cpu_usage(cpuid_per_numa : dict, hist :dict, freq_reader : SysfsReader = None):
     measures = dict()
-    global_usage = get_usage_global(cputime_hist=hist)
+    global_usage = sample_cpu_usage(cputime_hist=hist)
+    cpu_freq = freq_reader.read() if freq_reader is not None else dict()
     if global_usage != None: measures['cpu%_package-global'] = round(global_usage, PRECISION)
     for numa_id, cpuid_list in cpuid_per_numa.items():
-        numa_usage = get_usage_of(server_cpu_list=cpuid_list, cputime_hist=hist)
-        numa_freq  = get_freq_of(server_cpu_list=cpuid_list)
+        numa_usage = get_usage_of(cpu_index=get_cpu_index(cpuid_list=cpuid_list, cputime_hist=hist), cputime_hist=hist)
+        numa_freq  = get_freq_of(server_cpu_list=cpuid_list, cpu_freq=cpu_freq)
         if numa_usage != None: 
             measures['cpu%_package-' + str(numa_id)] = numa_usage
-            measures['freq_package-' + str(numa_id)] = numa_freq
+            if numa_freq != None: measures['freq_package-' + str(numa_id)] = numa_freq
     return measures
 
-class CpuTime(object):
-    def has_time(self):
-        return hasattr(self, 'idle') and hasattr(self, 'not_idle')
-
-    def set_time(self, idle : int, not_idle : int):
-        setattr(self, 'idle', idle)
-        setattr(self, 'not_idle', not_idle)
-
-    def get_time(self):
-        return getattr(self, 'idle'), getattr(self, 'not_idle')
-
-    def clear_time(self):
-        if hasattr(self, 'idle'): delattr(self, 'idle')
-        if hasattr(self, 'not_idle'): delattr(self, 'not_idle')
-
-def get_usage_global(cputime_hist : dict):
+def read_proc_stat():
+    """Parse /proc/stat in a single pass. Return the (idle, not_idle) counters of the global line and a matrix of the
+    (idle, not_idle) counters of each online cpu, indexed by cpu id (offline cpus are flagged as not present)"""
     with open(SYSFS_STAT, 'r') as f:
-        split = f.readlines()[0].split(' ')
-        split.remove('')
-    if 'global' not in cputime_hist: cputime_hist['global'] = CpuTime()
-    return __get_usage_of_line(split=split, hist_object=cputime_hist['global'])
-
-def get_usage_of(server_cpu_list : list, cputime_hist : dict):
-    cumulated_cpu_usage = 0
-    with open(SYSFS_STAT, 'r') as f:
-        lines = f.readlines()
-
+        lines = f.read().split(OUTPUT_NL)
+    cpu_lines = list()
     for line in lines:
-        split = line.split(' ')
-        if not split[SYSFS_STATS_KEYS['cpuid']].startswith('cpu'): break
-        if split[SYSFS_STATS_KEYS['cpuid']] not in server_cpu_list: continue
-
-        if split[SYSFS_STATS_KEYS['cpuid']] not in cputime_hist: cputime_hist[split[SYSFS_STATS_KEYS['cpuid']]] = CpuTime()
-        hist_object = cputime_hist[split[SYSFS_STATS_KEYS['cpuid']]]
-
-        cpu_usage = __get_usage_of_line(split=split, hist_object=hist_object)
-
-        # Add usage to cumulated value
-        if cumulated_cpu_usage != None and cpu_usage != None:
-            cumulated_cpu_usage+=cpu_usage
-        else: cumulated_cpu_usage = None # Do not break to compute others initializing values
-
-    if cumulated_cpu_usage != None: 
-        cumulated_cpu_usage = round(cumulated_cpu_usage/len(server_cpu_list), PRECISION)
-    return cumulated_cpu_usage
-
-def __get_usage_of_line(split : list, hist_object : object, update_history : bool = True):
-    idle          = sum([ int(split[SYSFS_STATS_KEYS[idle_key]])     for idle_key     in SYSFS_STATS_IDLE])
-    not_idle      = sum([ int(split[SYSFS_STATS_KEYS[not_idle_key]]) for not_idle_key in SYSFS_STATS_NTID])
-
-    # Compute delta
-    cpu_usage  = None
-    if hist_object.has_time():
-        prev_idle, prev_not_idle = hist_object.get_time()
-        delta_idle     = idle - prev_idle
-        delta_total    = (idle + not_idle) - (prev_idle + prev_not_idle)
-        if delta_total>0: # Manage overflow
-            cpu_usage = ((delta_total-delta_idle)/delta_total)*100
-
-    if update_history: hist_object.set_time(idle=idle, not_idle=not_idle)
+        if not line.startswith('cpu'): break
+        cpu_lines.append(line)
+
+    cpu_ids = np.array([int(line[3:line.index(' ')]) for line in cpu_lines[1:]], dtype=np.int64)
+    fields  = np.array(' '.join([line[line.index(' '):] for line in cpu_lines]).split(), dtype=np.int64).reshape(len(cpu_lines), -1)
+    times   = np.stack((fields[:, SYSFS_STATS_IDLE_IDX].sum(axis=1), fields[:, SYSFS_STATS_NTID_IDX].sum(axis=1)), axis=1)
+
+    size    = max(cpu_count(), int(cpu_ids.max()) + 1) if len(cpu_ids) else cpu_count()
+    counters = np.zeros((size, 2), dtype=np.int64)
+    present  = np.zeros(size, dtype=bool)
+    counters[cpu_ids] = times[1:]
+    present[cpu_ids]  = True
+    return times[0], counters, present
+
+def __get_usage_of_delta(prev_times : np.ndarray, times : np.ndarray):
+    # Work on the last axis (idle, not_idle) so that the global line and the per cpu matrix share the same computation
+    delta_idle  = times[..., 0] - prev_times[..., 0]
+    delta_total = times.sum(axis=-1) - prev_times.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cpu_usage = np.where(delta_total>0, ((delta_total-delta_idle)/delta_total)*100, np.nan) # Manage overflow
     return cpu_usage
 
-def read_core_usage(cputime_hist : dict, update_history : bool):
-    with open(SYSFS_STAT, 'r') as f:
-        lines = f.readlines()
-
-    measures = dict()
-    lines.pop(0) # remove global line, we focus on per cpu usage
-    for line in lines:
-        split = line.split(' ')
-        if not split[SYSFS_STATS_KEYS['cpuid']].startswith('cpu'): break
-
-        if split[SYSFS_STATS_KEYS['cpuid']] not in cputime_hist: cputime_hist[split[SYSFS_STATS_KEYS['cpuid']]] = CpuTime()
-        cpu_usage = __get_usage_of_line(split=split, hist_object=cputime_hist[split[SYSFS_STATS_KEYS['cpuid']]], update_history=update_history)
-        measures['cpu%_' + split[SYSFS_STATS_KEYS['cpuid']]] = cpu_usage
-
-    return measures
-
-def display_cache_usage(cache_topo : dict, cputime_hist : dict):
-    core_usage = read_core_usage(cputime_hist=cputime_hist, update_history=False)
-    associate_usage_to_cache_levels(core_usage=core_usage, cache_topo=cache_topo)
+def sample_cpu_usage(cputime_hist : dict):
+    """Read /proc/stat once and compute the usage of every cpu since last call from a single delta. The per cpu usage
+    is kept in the history (np.nan when unknown) to be reduced per package/core/cache domain. Return the global usage"""
+    global_times, counters, present = read_proc_stat()
+    global_usage = None
+    cpu_usage    = np.full(len(counters), np.nan)
+    if 'global' in cputime_hist:
+        global_usage = __get_usage_of_delta(cputime_hist['global'], global_times)
+        global_usage = float(global_usage) if not np.isnan(global_usage) else None
+        prev_counters, prev_present = cputime_hist['counters'], cputime_hist['present']
+        common = min(len(prev_counters), len(counters)) # cpu hotplug may change the matrix size
+        cpu_usage[:common] = __get_usage_of_delta(prev_counters[:common], counters[:common])
+        cpu_usage[:common][~(prev_present[:common] & present[:common])] = np.nan
+
+    cputime_hist['global']   = global_times
+    cputime_hist['counters'] = counters
+    cputime_hist['present']  = present
+    cputime_hist['usage']    = cpu_usage
+    return global_usage
+
+def get_cpu_index(cpuid_list : list, cputime_hist : dict):
+    """Convert a list of cpu names (cpuX) to an array of cpu ids, cached in the history"""
+    key = tuple(cpuid_list)
+    if 'index' not in cputime_hist: cputime_hist['index'] = dict()
+    if key not in cputime_hist['index']:
+        cputime_hist['index'][key] = np.array([int(cpu[3:]) for cpu in cpuid_list], dtype=np.int64)
+    return cputime_hist['index'][key]
+
+def get_usage_of(cpu_index : np.ndarray, cputime_hist : dict):
+    """Average usage of a set of cpus (package, core, cache domain...) from the usage computed at last sample"""
+    cpu_usage = cputime_hist.get('usage')
+    if cpu_usage is None or len(cpu_index) == 0: return None
+    values = cpu_usage[cpu_index[cpu_index < len(cpu_usage)]]
+    if len(values) != len(cpu_index) or np.isnan(values).any(): return None
+    return round(float(values.mean()), PRECISION)
+
+class CacheDomains(object):
+    """Cache hierarchy of Topology.cache_topo flattened once: the cpu ids of all domains are concatenated in a single index
+    array (offsets give the start of each domain), so that the usage of every domain is one reduction per tick"""
+
+    def __init__(self, cache_topo : dict):
+        self.labels, self.depths, self.leaves, cpu_lists = list(), list(), list(), list()
+        self.__flatten(cache_topo=cache_topo, depth=0, cpu_lists=cpu_lists)
+        self.sizes   = np.array([len(cpu_list) for cpu_list in cpu_lists], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)[:-1])).astype(np.int64)
+        self.index   = np.concatenate(cpu_lists).astype(np.int64) if cpu_lists else np.zeros(0, dtype=np.int64)
+        self.metrics = ['cpu%_' + label for label in self.labels]
+
+    def __flatten(self, cache_topo, depth : int, cpu_lists : list):
+        """Depth-first walk (parents before children, as displayed). Return the cpus below cache_topo"""
+        if not isinstance(cache_topo, dict): return list(cache_topo)
+        cpus = list()
+        for cache_id, child in cache_topo.items():
+            position = len(self.labels)
+            self.labels.append(cache_id)
+            self.depths.append(depth)
+            self.leaves.append(not isinstance(child, dict))
+            cpu_lists.append(None) # Filled once children are known
+            cpu_list = self.__flatten(cache_topo=child, depth=depth+1, cpu_lists=cpu_lists)
+            cpu_lists[position] = cpu_list
+            cpus.extend(cpu_list)
+        return cpus
+
+    def usage(self, cputime_hist : dict):
+        """Return the average usage of each domain from the per cpu usage of last sample (np.nan if unknown)"""
+        cpu_usage = cputime_hist.get('usage')
+        if cpu_usage is None or not len(self.index): return np.full(len(self.labels), np.nan)
+        if self.index.max() >= len(cpu_usage): # cpu hotplug shrank the matrix
+            cpu_usage = np.concatenate((cpu_usage, np.full(self.index.max() + 1 - len(cpu_usage), np.nan)))
+        return np.add.reduceat(cpu_usage[self.index], self.offsets) / self.sizes # a single offline cpu makes the domain unknown
+
+    def measures(self, cputime_hist : dict):
+        return {metric: round(float(usage), PRECISION) for metric, usage in zip(self.metrics, self.usage(cputime_hist)) if not np.isnan(usage)}
+
+def display_cache_usage(cache_domains : CacheDomains, cache_measures : dict):
+    """Print the hierarchy, leaves (cores) are only displayed above 51%"""
+    for label, depth, is_leaf, metric in zip(cache_domains.labels, cache_domains.depths, cache_domains.leaves, cache_domains.metrics):
+        if metric not in cache_measures: continue
+        if not is_leaf or cache_measures[metric]>51: print(' ' * (2*depth) + label + ' : ' + str(cache_measures[metric]))
     print('###')
 
-def associate_usage_to_cache_levels(core_usage : dict, cache_topo, label = None, padding_length = -2):
-    if isinstance(cache_topo, dict):
-        cpu_list = list()
-        for cache_id in cache_topo.keys():
-
-            child_label = ""
-            if label is not None: child_label = label + '_'
-            child_label += cache_id
-
-            cpu_list.extend(associate_usage_to_cache_levels(core_usage=core_usage, cache_topo=cache_topo[cache_id], label=child_label, padding_length=padding_length+2))
+def get_freq_of(server_cpu_list : list, cpu_freq : dict):
+    values = [cpu_freq[cpu] for cpu in server_cpu_list if cpu_freq.get(cpu) is not None] # offline cpus are ignored
+    if not values: return None
+    return round(sum(values)/len(values), PRECISION)
 
-        if label is not None:
-            values = [core_usage['cpu%_cpu' + str(cpu)] for cpu in cpu_list]
-            if None not in values:
-                usage = sum(values) / len(cpu_list)
-                line = ' ' * padding_length
-                line += label + ' : ' + str(usage)
-                print(line)
-        return cpu_list
-
-    else:
-        if label is not None:
-            values = [core_usage['cpu%_cpu' + str(cpu)] for cpu in cache_topo]
-            if None not in values:
-                usage = sum(values) / len(cache_topo)
-                line = ' ' * padding_length
-                line += label + ' : ' + str(usage)
-                if usage>51: print(line)
-        return cache_topo
-
-def get_freq_of(server_cpu_list : list):
-    cumulated_cpu_freq = 0
-    for cpu in server_cpu_list:
-        with open(SYSFS_FREQ.replace('{core}', str(cpu)), 'r') as f:
-            cumulated_cpu_freq+= int(f.read())
-    return round(cumulated_cpu_freq/len(server_cpu_list), PRECISION)
+def open_freq_reader(cpuid_per_numa : dict):
+    paths = dict()
+    for cpuid_list in cpuid_per_numa.values():
+        for cpu in cpuid_list: paths[cpu] = SYSFS_FREQ.replace('{core}', str(cpu))
+    return SysfsReader(paths=paths, watch=SYSFS_ONLINE if exists(SYSFS_ONLINE) else None)
 
 ###########################################
 # Find and Read specific process
 ###########################################
 
-def find_process(keyword : str = 'qemu'):
-    """Use pgrep to find the first PID matching a name process."""
-    try:
-        result = subprocess.run(['pgrep', 'qemu'], capture_output=True, text=True)
-        if result.stdout:
-            return int(result.stdout.strip().split()[0])  # Return the first QEMU PID found
-        else:
-            return None
-    except subprocess.SubprocessError as e:
-        return None
-
-def get_child_process(pid):
-    """Return a list of child PIDs of the given process from /proc/<pid>/task/<pid>/children."""
+class ProcessScanner(object):
+    """Find every process whose name contains keyword (e.g. QEMU/KVM) and its vCPU threads by walking /proc.
+    The pid -> vCPU map is updated incrementally: only pids and threads never seen before have their name read. A pid
+    not matching is read again on the next SCAN_RECHECK scans, as a VM may be caught between fork and exec"""
+
+    def __init__(self, keyword : str = 'qemu'):
+        self.keyword = keyword
+        self.ignored = set()   # pids which do not match the keyword (for good)
+        self.pending = dict()  # pids which do not match the keyword yet -> scans left before being ignored
+        self.process = dict()  # pid -> {vcpu tid: label}
+        self.names   = dict()  # pid -> VM name
+        self.threads = dict()  # pid -> tids already inspected
+        self.removed = list()  # pids and tids which disappeared on last scan
+
+    def scan(self):
+        """Refresh the map with a single listing of /proc (plus one listing per matching process) and return it"""
+        self.removed = list()
+        pids = {int(entry) for entry in listdir(PROCFS) if entry.isdigit()}
+        self.ignored &= pids # pids may be reused once released
+        self.pending = {pid: left for pid, left in self.pending.items() if pid in pids}
+        for pid in [pid for pid in self.process.keys() if pid not in pids]: self.__forget(pid)
+
+        for pid in pids - self.ignored - self.process.keys():
+            name = get_pid_name(pid)
+            if name is None or self.keyword not in name:
+                left = self.pending.pop(pid, SCAN_RECHECK)
+                if left > 0: self.pending[pid] = left - 1
+                else: self.ignored.add(pid)
+                continue
+            self.pending.pop(pid, None)
+            self.process[pid], self.threads[pid], self.names[pid] = dict(), set(), get_vm_name(pid)
+
+        for pid in list(self.process.keys()): self.__scan_threads(pid)
+        return self.process
+
+    def __scan_threads(self, pid : int):
+        try:
+            tids = {int(entry) for entry in listdir(PROCFS + str(pid) + '/task')}
+        except FileNotFoundError: # Exited since the listing of /proc
+            self.__forget(pid)
+            return
+        for tid in [tid for tid in self.process[pid].keys() if tid not in tids]:
+            del self.process[pid][tid]
+            self.removed.append(tid)
+        for tid in tids - self.threads[pid]:
+            name = get_pid_name(tid)
+            if name is not None and 'CPU' in name: self.process[pid][tid] = name.replace('/KVM', '')
+        self.threads[pid] = tids
+
+    def __forget(self, pid : int):
+        self.removed.extend([pid] + list(self.process[pid].keys()))
+        for content in [self.process, self.threads, self.names]: del content[pid]
+
+def get_vm_name(pid):
+    """Return the guest name of a QEMU process (-name guest=xxx,...), its pid otherwise"""
     try:
-        result = subprocess.run(['ls', '/proc/' + str(pid) + '/task'], capture_output=True, text=True)
-        if result.stdout:
-            children = [int(child) for child in result.stdout.strip().split()]
-            children.remove(pid)
-            return children
-    except FileNotFoundError:
-       pass
-    return []
+        with open(PROCFS + str(pid) + '/cmdline', 'r') as f:
+            arguments = f.read().split('\0')
+        if '-name' in arguments:
+            name = arguments[arguments.index('-name')+1].split(',')[0]
+            return name.replace('guest=', '')
+    except (FileNotFoundError, IndexError):
+        pass
+    return str(pid)
 
 def does_file_exist(file : str, to_be_removed : bool = False):
     try:
@@ -267,18 +516,17 @@ def does_file_exist(file : str, to_be_removed : bool = False):
         return False
 
 def get_pid_name(pid):
+    """Return the name of a pid (or tid) without whitespaces (e.g. CPU0/KVM)"""
     try:
-        with open(f'/proc/{pid}/stat', 'r') as f:
-            stat_line = f.read()
-            comm = stat_line[stat_line.find("(")+1:stat_line.find(")")]
-            return comm.replace(' ','')
-    except FileNotFoundError:
+        with open(PROCFS + str(pid) + '/comm', 'r') as f:
+            return f.read().strip().replace(' ','')
+    except (FileNotFoundError, ProcessLookupError):
         return None
 
 def read_process_stat(pid):
     """Read the CPU usage times (utime, stime) from /proc/<pid>/stat."""
     try:
-        with open(f'/proc/{pid}/stat', 'r') as f:
+        with open(PROCFS + str(pid) + '/stat', 'r') as f:
             stat_line = f.read()
             comm = stat_line[stat_line.find("(")+1:stat_line.find(")")]
             # comm field may contains a whitespace that we need to treat
@@ -294,20 +542,70 @@ def read_process_stat(pid):
 def read_process_schedstat(pid):
     """Read the CPU usage times (utime, stime) from /proc/<pid>/stat."""
     try:
-        with open(f'/proc/{pid}/schedstat', 'r') as f:
+        with open(PROCFS + str(pid) + '/schedstat', 'r') as f:
             schedstat_line = f.read().split()
             cputime = int(schedstat_line[0]) # time spent on the cpu (in nanoseconds)
             return cputime # ns
     except FileNotFoundError:
         return None
 
+class VmCgroups(object):
+    """Locate the cgroup v2 scope of each VM in the libvirt machine.slice hierarchy (from /proc/<pid>/cgroup, once per
+    pid) and its per vCPU sub-cgroups (vcpuX, directly under the scope or under libvirt/) when they exist"""
+
+    def __init__(self):
+        self.available = exists(CGROUP_ROOT + 'cgroup.controllers')
+        self.cgroups = dict() # pid -> {'path': scope, 'vcpus': {CPUx: path}} or None when /proc must be used
+
+    def of(self, pid : int):
+        if not self.available: return None
+        if pid not in self.cgroups: self.cgroups[pid] = self.__locate(pid)
+        return self.cgroups[pid]
+
+    def __locate(self, pid : int):
+        try:
+            with open(PROCFS + str(pid) + '/cgroup', 'r') as f:
+                lines = f.read().split(OUTPUT_NL)
+        except FileNotFoundError:
+            return None
+        for line in lines:
+            if not line.startswith('0::'): continue # cgroup v1 hierarchies
+            folders = line[3:].strip('/').split('/')
+            if 'machine.slice' not in folders: return None # Not started by libvirt: the cgroup may hold other processes
+            scopes = [index for index, folder in enumerate(folders) if folder.endswith('.scope')]
+            if not scopes: return None
+            path = CGROUP_ROOT + '/'.join(folders[:scopes[0]+1]) + '/'
+            vcpus = dict()
+            for parent in [path, path + 'libvirt/']:
+                if not exists(parent): continue
+                for folder in listdir(parent):
+                    if re.match('^vcpu[0-9]+$', folder): vcpus['CPU' + folder[4:]] = parent + folder + '/'
+            return {'path': path, 'vcpus': vcpus}
+        return None
+
+    def forget(self, pid : int):
+        cgroup = self.cgroups.pop(pid, None)
+        if cgroup is None: return
+        for path in [cgroup['path']] + list(cgroup['vcpus'].values()):
+            for key in ['usage', 'user', 'system']: forget_process(path + key)
+
+def read_cgroup_stat(path : str):
+    """Read usage_usec, user_usec and system_usec of a cgroup cpu.stat, in ns (None if the cgroup is gone)"""
+    try:
+        with open(path + 'cpu.stat', 'r') as f:
+            fields = dict(line.split() for line in f.read().split(OUTPUT_NL) if line)
+        return {key: int(fields[key + '_usec'])*1000 for key in ['usage', 'user', 'system']}
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+vm_cgroups = None
 process_hist_dict = {}
 def get_process_usage(pid : int, curr_time : int): # curr_time in ns
     """Calculate the CPU usage percentage of a given pid since last call."""
     global process_hist_dict
     usage = None
     if (curr_time is not None):
-        curr_timestamp = time.time_ns() # 10^-9
+        curr_timestamp = CLOCK()
         if str(pid) in process_hist_dict:
             prev_timestamp, prev_time = process_hist_dict[str(pid)]
             elapsed_time = (curr_timestamp - prev_timestamp)
@@ -315,53 +613,169 @@ def get_process_usage(pid : int, curr_time : int): # curr_time in ns
         process_hist_dict[str(pid)] = (curr_timestamp, curr_time)
     return usage
 
-def monitor_process(process_as_dict : dict, replace_pid_per_label : dict = None, output_dict : dict = None):
-    for process, child_list in process_as_dict.items():
-        # Overall process is monitored using stat
-        process_usage = get_process_usage(process, read_process_stat(process))
-        if LIVE_DISPLAY: print('vm', process_usage)
-        if output_dict is not None and process_usage is not None: output_dict['vm'] = process_usage
-        # Details of repartition is obtained using schedstat
-        for child in child_list:
-            child_usage = get_process_usage(child, read_process_schedstat(child))
-            if LIVE_DISPLAY: print(child if (replace_pid_per_label is None or str(child) not in replace_pid_per_label) else replace_pid_per_label[str(child)], child_usage)
-            if output_dict is not None and child_usage is not None: output_dict[child if (replace_pid_per_label is None or str(child) not in replace_pid_per_label) else replace_pid_per_label[str(child)]] = child_usage
-        break # We only do the first VM for now
+def forget_process(pid : int):
+    """Drop the history of a pid which is not monitored anymore"""
+    process_hist_dict.pop(str(pid), None)
+
+def monitor_process(scanner : ProcessScanner, output_dict : dict = None):
+    """Monitor all VMs on the same tick. Each VM is reported as vm-<name> (and vm-<name>_CPUx), the first one found
+    is also reported as vm (and CPUx) as in single VM experiments. VMs started by libvirt are accounted with a single
+    read of their cgroup cpu.stat (plus vm-<name>_user and vm-<name>_system), other ones from /proc"""
+    global vm_cgroups
+    if vm_cgroups is None: vm_cgroups = VmCgroups()
+    scanner.scan()
+    for pid in scanner.removed:
+        forget_process(pid)
+        vm_cgroups.forget(pid)
+    for index, (process, child_dict) in enumerate(scanner.process.items()):
+        prefixes = ['vm-' + scanner.names[process]] + (['vm'] if index == 0 else [])
+        cgroup = vm_cgroups.of(process)
+        if cgroup is not None:
+            stat = read_cgroup_stat(cgroup['path'])
+            usages = {key: get_process_usage(cgroup['path'] + key, stat[key] if stat is not None else None) for key in ['usage', 'user', 'system']}
+            process_usage = usages['usage']
+            if output_dict is not None:
+                for key in ['user', 'system']:
+                    if usages[key] is not None: output_dict[prefixes[0] + '_' + key] = usages[key]
+        else: # Overall process is monitored using stat
+            process_usage = get_process_usage(process, read_process_stat(process))
+        if LIVE_DISPLAY: print(prefixes[0], process_usage)
+        if output_dict is not None and process_usage is not None:
+            for prefix in prefixes: output_dict[prefix] = process_usage
+        # Details of repartition is obtained using vCPU sub-cgroups, or schedstat
+        if cgroup is not None and not VCPU_DETAIL: continue
+        for child, label in child_dict.items():
+            if cgroup is not None and label in cgroup['vcpus']:
+                stat = read_cgroup_stat(cgroup['vcpus'][label])
+                child_usage = get_process_usage(cgroup['vcpus'][label] + 'usage', stat['usage'] if stat is not None else None)
+            else:
+                child_usage = get_process_usage(child, read_process_schedstat(child))
+            if LIVE_DISPLAY: print(prefixes[0] + '_' + label, child_usage)
+            if output_dict is not None and child_usage is not None:
+                output_dict[prefixes[0] + '_' + label] = child_usage
+                if index == 0: output_dict[label] = child_usage
 
 ###########################################
 # Read libvirt
 ###########################################
 
+libvirt_static_cache = {} # Domain UUID -> attributes which do not change while the domain is running
+def watch_libvirt_lifecycle(connector):
+    """Invalidate the static attributes of a domain on each of its lifecycle events (start, stop, redefinition...).
+    libvirt.virEventRegisterDefaultImpl() must have been called before opening the connection"""
+    def lifecycle_callback(connection, domain, event, detail, opaque):
+        libvirt_static_cache.pop(domain.UUIDString(), None)
+    def run_event_loop():
+        while True: libvirt.virEventRunDefaultImpl()
+    connector.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, lifecycle_callback, None)
+    threading.Thread(target=run_event_loop, daemon=True).start()
+
+def get_domain_static(domain, stats : dict):
+    uuid = domain.UUIDString()
+    if uuid not in libvirt_static_cache: # Bulk statistics already hold the maximums, RPCs are only a fallback
+        vcpu = stats['vcpu.maximum'] if 'vcpu.maximum' in stats else domain.maxVcpus()
+        memory = stats['balloon.maximum'] if 'balloon.maximum' in stats else domain.maxMemory() # KiB
+        libvirt_static_cache[uuid] = {'name': domain.name(), 'vcpu': vcpu, 'memory': int(memory/1024)}
+    return libvirt_static_cache[uuid]
+
 def read_libvirt():
+    """Collect all running domains with a single bulk call per tick. Report aggregated metrics and, per domain, the
+    vCPU time (ns), balloon memory (MB) and block/network counters (bytes)"""
     count = 0
     cpu_cumul = 0
     mem_cumul = 0
-    for domain_id in VM_CONNECTOR.listDomainsID():
+    measures = dict()
+    stats_type = libvirt.VIR_DOMAIN_STATS_STATE | libvirt.VIR_DOMAIN_STATS_VCPU | libvirt.VIR_DOMAIN_STATS_BALLOON | libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE
+    try:
+        records = VM_CONNECTOR.getAllDomainStats(stats_type, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+    except libvirt.libvirtError: # Driver without bulk statistics
+        records = [(domain, dict()) for domain in VM_CONNECTOR.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE)]
+
+    running = set()
+    for domain, stats in records:
         try:
-            virDomain = VM_CONNECTOR.lookupByID(domain_id)
-            cpu_cumul+=virDomain.maxVcpus()
-            mem_cumul+=int(virDomain.maxMemory()/1024)
-            count+=1
-        except libvirt.libvirtError as ex:  # VM is not alived anymore
-            pass
-    return {'libvirt_vm_count': count, 'libvirt_vm_cpu_cml': cpu_cumul, 'libvirt_vm_mem_cml': mem_cumul}
+            static = get_domain_static(domain, stats)
+        except libvirt.libvirtError: # VM is not alived anymore
+            continue
+        running.add(domain.UUIDString())
+        cpu_cumul+=static['vcpu']
+        mem_cumul+=static['memory']
+        count+=1
+
+        prefix = 'libvirt_vm-' + static['name'] + '_'
+        vcpu_time = [value for key, value in stats.items() if key.startswith('vcpu.') and key.endswith('.time')]
+        if vcpu_time: measures[prefix + 'vcpu_time'] = sum(vcpu_time)
+        if 'balloon.current' in stats: measures[prefix + 'mem_balloon'] = int(stats['balloon.current']/1024)
+        for counter in ['block.{}.rd.bytes', 'block.{}.wr.bytes', 'net.{}.rx.bytes', 'net.{}.tx.bytes']:
+            device_type = counter.split('.')[0]
+            values = [stats[counter.format(index)] for index in range(stats.get(device_type + '.count', 0)) if counter.format(index) in stats]
+            if values: measures[prefix + counter.replace('.{}.', '_').replace('.', '_')] = sum(values)
+
+    for uuid in [uuid for uuid in list(libvirt_static_cache.keys()) if uuid not in running]: libvirt_static_cache.pop(uuid, None)
+    aggregated = {'libvirt_vm_count': count, 'libvirt_vm_cpu_cml': cpu_cumul, 'libvirt_vm_mem_cml': mem_cumul}
+    aggregated.update(measures)
+    return aggregated
+
+###########################################
+# Estimate VM power online
+###########################################
+
+def load_model(path : str):
+    """Load a model exported by cinergy.pipeline (intercept, coefficients, degree and host core count)"""
+    with open(path, 'r') as f: content = json.load(f)
+    series = np.array(content['coefficients'], dtype=np.float64)
+    series[0] += content['intercept'] # Static part is included
+    return {'series': series, 'degree': int(content['degree']), 'core_host': int(content['core_host'])}
+
+def estimate_vm_power(model : dict, rapl_measures : dict, cpu_measures : dict, scanner : ProcessScanner):
+    """Isolated power of each running VM (top-down, from the model), its share of the measured power (bottom-up)
+    and their ratio. Only running VMs are kept in history so that memory does not grow with VM churn"""
+    measures = dict()
+    scanner.scan()
+    for pid in scanner.removed: forget_process(pid)
+
+    usage_per_vm = dict()
+    for pid in scanner.process.keys():
+        usage = get_process_usage(pid, read_process_stat(pid))
+        if usage is not None: usage_per_vm[scanner.names[pid]] = usage
+    if not usage_per_vm: return measures
+
+    vm_usage = np.array(list(usage_per_vm.values()), dtype=np.float64)
+    host_percent_vm = vm_usage / model['core_host']
+    top_down = np.polynomial.polynomial.polyval(host_percent_vm, model['series']) # Single Horner call for all VMs
+    bottom_up = None
+    if rapl_measures.get('package-global-watt') is not None and cpu_measures.get('cpu%_package-global'):
+        bottom_up = (host_percent_vm / cpu_measures['cpu%_package-global']) * rapl_measures['package-global-watt']
+
+    for index, name in enumerate(usage_per_vm.keys()):
+        measures['vm-' + name + '_usage'] = round(float(vm_usage[index]), PRECISION)
+        measures['vm-' + name + '_top-down'] = round(float(top_down[index]), PRECISION)
+        if bottom_up is not None:
+            measures['vm-' + name + '_bottom-up'] = round(float(bottom_up[index]), PRECISION)
+            if top_down[index] != 0: measures['vm-' + name + '_ratio'] = round(float(bottom_up[index]/top_down[index]), PRECISION)
+    return measures
 
 ###########################################
 # Read joule file, convert to watt
 ###########################################
-def read_rapl(rapl_sysfs : dict, hist : dict, current_time : int):
+def read_rapl(rapl_reader : SysfsReader, hist : dict, current_time : int, energy_range : dict = {}):
+    """Energy (J) and power (W) of each domain since last call, plus the energy accumulated since the beginning of the
+    phase (hist['total'], in uJ). Package global measures are only given when all domains are valid on this tick"""
     measures = dict()
     overflow = False
     package_global_joule = 0
     package_global_watt = 0
-    for domain, file in rapl_sysfs.items():
-        joule, watt = read_joule_file(domain=domain, file=file, hist=hist, current_time=current_time)
+    package_global_total = 0
+    for domain, uj_count in rapl_reader.read().items():
+        joule, watt = read_joule_file(domain=domain, uj_count=uj_count, hist=hist, current_time=current_time, energy_range=energy_range.get(domain))
         if watt !=None:
             measures[domain + '-joule'] = round(joule,PRECISION)
             measures[domain + '-watt'] = round(watt,PRECISION)
+            measures[domain + '-total-joule'] = round(hist['total'][domain] / (10**6),PRECISION)
             if 'package-' in domain: 
                 package_global_joule += joule
                 package_global_watt  += watt
+                package_global_total += hist['total'][domain]
         else: overflow=True
 
     # Track time for next round
@@ -371,11 +785,15 @@ def read_rapl(rapl_sysfs : dict, hist : dict, current_time : int):
         if not overflow: 
             measures['package-global-joule'] = round(package_global_joule,PRECISION)
             measures['package-global-watt']  = round(package_global_watt,PRECISION)
+            measures['package-global-total-joule'] = round(package_global_total / (10**6),PRECISION)
     return measures
 
-def read_joule_file(domain : str, file : str, hist : dict, current_time : int):
-    # Read file
-    with open(file, 'r') as f: current_uj_count = int(f.read())
+def read_joule_file(domain : str, uj_count : int, hist : dict, current_time : int, energy_range : int = None):
+    # Value was read by the persistent reader
+    current_uj_count = uj_count
+    if current_uj_count == None:
+        hist[domain] = None
+        return None, None
 
     # Compute delta
     current_uj_delta = current_uj_count - hist[domain] if hist[domain] != None else None
@@ -383,7 +801,13 @@ def read_joule_file(domain : str, file : str, hist : dict, current_time : int):
 
     # Manage exceptional cases
     if current_uj_delta == None: return None, None # First call
-    if current_uj_delta < 0: return None, None # Overflow
+    if energy_range is not None:
+        # W x ns / 1000 = uJ: with enough time between reads, the counter may have wrapped more than once
+        if (current_time - hist['time']) * RAPL_MAX_POWER / 1000 >= energy_range: return None, None
+        if current_uj_delta < 0: current_uj_delta += energy_range # Wrapped once
+    elif current_uj_delta < 0: return None, None # Overflow of unknown range
+    if 'total' not in hist: hist['total'] = dict()
+    hist['total'][domain] = hist['total'].get(domain, 0) + current_uj_delta # Python int: no overflow (int64 on export)
 
     # Convert to watt
     current_us_delta = (current_time - hist['time'])/1000 #delta with ns to us
@@ -396,60 +820,579 @@ def read_joule_file(domain : str, file : str, hist : dict, current_time : int):
 # I/O
 ###########################################
 
-rapl_hist, cpu_hist, output_file, launch_at, last_call = {}, {}, '', 0, 0
-def read_system(label : str, rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, misc : dict = {}, repetition : int = 1, sleep : int = 0, init : bool = False, monitor_process_params : dict = None):
-    global rapl_hist, cpu_hist, output_file, launch_at, last_call
-    if init:
-        rapl_hist = {name:None for name in rapl_sysfs.keys()}
-        rapl_hist['time'] = None # for joule to watt conversion
-        cpu_hist = {}
-        launch_at = time.time_ns()
-        last_call = 0
-        output_file = OUTPUT_PREFIX + '-' + label + '.csv'
-        with open(output_file, 'w') as f: f.write(OUTPUT_HEADER + OUTPUT_NL)
-
-    for _ in range(repetition):
-        time_to_sleep = (sleep*10**9) - (time.time_ns() - last_call) if last_call > 0 else (sleep*10**9)
-        if time_to_sleep>0: time.sleep(time_to_sleep/10**9)
-        else: print('Warning: overlap iteration', -(time_to_sleep/10**9), 's')
-        last_call = time.time_ns()
-
-        rapl_measures = read_rapl(rapl_sysfs=rapl_sysfs, hist=rapl_hist, current_time=last_call)
-        cpu_measures  = dict()
-        if PER_CACHE_USAGE:
-            display_cache_usage(cputime_hist=cpu_hist, cache_topo=cache_topo)
-        for key, value in read_cpu_usage(cpuid_per_numa=cpuid_per_numa, hist=cpu_hist).items(): cpu_measures[key] = value
-        libvirt_measures = dict()
-        if VM_CONNECTOR != None: libvirt_measures = read_libvirt()
-
-        if monitor_process_params is not None: monitor_process(**monitor_process_params)
-        output(output_file=output_file, rapl_measures=rapl_measures, cpu_measures=cpu_measures, libvirt_measures=libvirt_measures, misc=misc, time_since_launch=int((last_call-launch_at)/(10**9)))
+class OutputWriter(object):
+    """Buffer records of a phase and flush them by batch, once OUTPUT_FLUSH_SIZE records are pending or
+    OUTPUT_FLUSH_DELAY seconds elapsed since last flush. Backends implement dump().
+    Marks (e.g. load steps completed) can be placed between records: a batch then stops at the last mark pending, so
+    that the position after the flush (durable) is where the output can be resumed from"""
+
+    def __init__(self, label : str, init : bool):
+        self.label = label
+        self.buffer = list()
+        self.marks = list() # (buffer index, mark) not flushed yet
+        self.durable = None # (last mark flushed, position right after it)
+        self.last_flush = time.monotonic()
+
+    def write(self, timestamp : int, measures : dict):
+        self.buffer.append((timestamp, measures))
+        if len(self.buffer) >= OUTPUT_FLUSH_SIZE or (time.monotonic() - self.last_flush) >= OUTPUT_FLUSH_DELAY:
+            self.flush(at_mark=True)
+
+    def mark(self, mark):
+        self.marks.append((len(self.buffer), mark))
+
+    def flush(self, at_mark : bool = False):
+        """Dump the buffer, or only the records before the last mark if at_mark (the others stay buffered)"""
+        cut = self.marks[-1][0] if at_mark and self.marks else len(self.buffer)
+        if cut: self.dump(self.buffer[:cut])
+        flushed = [mark for index, mark in self.marks if index <= cut]
+        if flushed: self.durable = (flushed[-1], self.position())
+        self.buffer = self.buffer[cut:]
+        self.marks = [(index - cut, mark) for index, mark in self.marks if index > cut]
+        self.last_flush = time.monotonic()
+
+    def dump(self, records : list):
+        raise NotImplementedError()
+
+    def checkpoint(self):
+        """Flush pending records and return the position to resume from (backend specific)"""
+        self.flush()
+        return self.position()
+
+    def position(self):
+        raise NotImplementedError()
+
+    def close(self):
+        self.flush()
+
+class CsvWriter(OutputWriter):
+    """Long format: one timestamp,domain,measure line per metric. Positions are file offsets"""
+
+    def __init__(self, label : str, init : bool, position : int = None):
+        super().__init__(label=label, init=init)
+        self.path = OUTPUT_PREFIX + '-' + label + '.csv'
+        if position is not None: # Drop what was written after the checkpoint
+            self.file = open(self.path, 'r+')
+            self.file.truncate(position)
+            self.file.seek(position)
+            return
+        self.file = open(self.path, 'w' if init else 'a')
+        if init: self.file.write(OUTPUT_HEADER + OUTPUT_NL)
+
+    def position(self):
+        return self.file.tell()
+
+    @staticmethod
+    def is_valid(label : str, position : int):
+        path = OUTPUT_PREFIX + '-' + label + '.csv'
+        return exists(path) and os.path.getsize(path) == position
+
+    @staticmethod
+    def can_resume(label : str, position : int):
+        """Output holds at least what was written at the checkpoint"""
+        path = OUTPUT_PREFIX + '-' + label + '.csv'
+        return exists(path) and os.path.getsize(path) >= position
+
+    def dump(self, records : list):
+        lines = list()
+        for timestamp, measures in records:
+            prefix = str(timestamp) + ','
+            for domain, measure in measures.items(): lines.append(prefix + domain + ',' + str(measure) + OUTPUT_NL)
+        self.file.write(''.join(lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+class NpzWriter(OutputWriter):
+    """Wide format: each flush is a NumPy archive with a timestamp column and one column per domain
+    (np.nan when a domain is missing on a tick). Chunks are numbered OUTPUT_PREFIX-label-XXXXX.npz. Positions are chunk numbers"""
+
+    def __init__(self, label : str, init : bool, position : int = None):
+        super().__init__(label=label, init=init)
+        self.pattern = OUTPUT_PREFIX + '-' + label + '-*.npz'
+        existing = sorted(glob.glob(self.pattern))
+        if init or position is not None: # Drop what was written after the checkpoint
+            for chunk in existing[position:] if position is not None else existing: remove(chunk)
+            existing = existing[:position] if position is not None else list()
+        self.chunk = int(existing[-1][-len('00000.npz'):-len('.npz')]) + 1 if existing else 0
+
+    def position(self):
+        return self.chunk
+
+    @staticmethod
+    def is_valid(label : str, position : int):
+        return len(glob.glob(OUTPUT_PREFIX + '-' + label + '-*.npz')) == position
+
+    @staticmethod
+    def can_resume(label : str, position : int):
+        """Output holds every chunk written before the checkpoint"""
+        return all(exists(OUTPUT_PREFIX + '-' + label + '-' + str(chunk).zfill(5) + '.npz') for chunk in range(position))
+
+    def dump(self, records : list):
+        columns = {'timestamp': np.array([timestamp for timestamp, _ in records], dtype=np.int64)}
+        domains = dict.fromkeys([domain for _, measures in records for domain in measures.keys()]) # ordered union
+        for domain in domains:
+            values = [measures.get(domain) for _, measures in records]
+            if any(isinstance(value, str) for value in values): # e.g. phase
+                columns[domain] = np.array(['' if value is None else value for value in values], dtype=np.str_)
+            else:
+                columns[domain] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        path = OUTPUT_PREFIX + '-' + self.label + '-' + str(self.chunk).zfill(5) + '.npz'
+        with open(path + '.tmp', 'wb') as f: # a chunk is either complete or absent
+            np.savez(f, **columns)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.chunk+=1
+
+OUTPUT_WRITERS = {'csv': CsvWriter, 'npz': NpzWriter}
+
+class SelfOverhead(object):
+    """Wall time of each stage of a tick and CPU time of the sampler process (all threads, consumers included), so that
+    its own load can be subtracted from the measures. Totals are kept per phase for the summary"""
+
+    def __init__(self):
+        self.last_cpu_ns, self.last_tick = None, None
+        self.output_ns = None # output() of a tick is only known on the next one
+        self.reset(label=None)
+
+    def reset(self, label : str):
+        self.label = label
+        self.ticks = 0
+        self.totals = dict()
+
+    def begin(self):
+        self.stages = dict()
+        self.last = time.perf_counter_ns()
+
+    def lap(self, stage : str):
+        now = time.perf_counter_ns()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    def measures(self, tick : int):
+        """Return the overhead metrics of current tick (stages completed so far, previous output and cpu time)"""
+        measures = {'overhead_' + stage + '_ns': duration for stage, duration in self.stages.items()}
+        if self.output_ns is not None: measures['overhead_output_ns'] = self.output_ns
+        cpu_ns = time.process_time_ns() # user and system time of every thread, without any file read
+        if self.last_cpu_ns is not None and tick > self.last_tick:
+            measures['overhead_self_cpu_ns'] = cpu_ns - self.last_cpu_ns
+            measures['overhead_self_cpu%'] = round((cpu_ns - self.last_cpu_ns)*100/(tick - self.last_tick), 3)
+        self.last_cpu_ns, self.last_tick = cpu_ns, tick
+        self.ticks+=1
+        for metric, value in measures.items(): self.totals[metric] = self.totals.get(metric, 0) + value
+        return measures
+
+    def end_output(self, begin : int):
+        self.output_ns = time.perf_counter_ns() - begin
+
+    def summary(self):
+        if not self.ticks: return
+        print('Sampler overhead on', self.label, '(mean of', self.ticks, 'ticks):')
+        for metric, total in self.totals.items():
+            if metric.endswith('_ns'): print(' ', metric.replace('overhead_', '').replace('_ns', '').ljust(12), round(total/self.ticks/10**6, 3), 'ms')
+            else: print(' ', metric.replace('overhead_', '').ljust(12), round(total/self.ticks, 3))
+        self.reset(label=self.label)
 
-def output(output_file : str, rapl_measures : dict, cpu_measures : dict, libvirt_measures : dict, misc : dict, time_since_launch : int):
+###########################################
+# Sample pipeline
+###########################################
 
-    if LIVE_DISPLAY and rapl_measures:
+class SampleRecord(collections.namedtuple('SampleRecord', ['timestamp', 'misc', 'rapl', 'cpu', 'cache', 'sampler', 'estimation'])):
+    """Measures of a tick, never modified once pushed"""
+    __slots__ = ()
+
+    def measures(self, libvirt_measures : dict = {}, pipeline_measures : dict = {}):
+        measures = dict(self.misc)
+        for measures_of in [self.rapl, self.cpu, self.cache, libvirt_measures, self.sampler, pipeline_measures, self.estimation]: measures.update(measures_of)
+        return measures
+
+class SampleRing(object):
+    """Bounded ring of records shared by several consumers, each one with its own cursor. The producer never waits: a
+    consumer lapped by the producer skips the records overwritten, which are counted as dropped"""
+
+    def __init__(self, size : int):
+        self.size = size
+        self.records = [None] * size
+        self.head = 0 # Sequence number of the next record
+        self.condition = threading.Condition()
+
+    def put(self, record : SampleRecord):
+        with self.condition:
+            self.records[self.head % self.size] = record
+            self.head+=1
+            self.condition.notify_all()
+
+    def get(self, cursor : int):
+        """Wait for records after cursor. Return them, the next cursor and the count of records lost"""
+        with self.condition:
+            while cursor == self.head: self.condition.wait()
+            dropped = max(0, self.head - self.size - cursor)
+            cursor+= dropped
+            return [self.records[sequence % self.size] for sequence in range(cursor, self.head)], self.head, dropped
+
+class Consumer(threading.Thread):
+    """Consume the records of a ring on its own thread. handle() is called with all records available at once"""
+
+    def __init__(self, ring : SampleRing, name : str):
+        super().__init__(name=name, daemon=True)
+        self.ring = ring
+        self.cursor = ring.head
+        self.dropped = 0
+
+    def run(self):
+        while True:
+            records, cursor, dropped = self.ring.get(self.cursor)
+            self.dropped+= dropped
+            try:
+                self.handle(records)
+            except Exception as err: # A failing output must not stop the others
+                print('Warning:', self.name, 'consumer failed:', err)
+            with self.ring.condition:
+                self.cursor = cursor
+                self.ring.condition.notify_all()
+
+    def backlog(self):
+        return self.ring.head - self.cursor
+
+    def handle(self, records : list):
+        raise NotImplementedError()
+
+class LibvirtConsumer(Consumer):
+    """Refresh libvirt statistics once per batch of records (late batches collapse into a single bulk call)"""
+
+    def __init__(self, ring : SampleRing):
+        super().__init__(ring=ring, name='libvirt')
+        self.latest = dict()
+
+    def handle(self, records : list):
+        begin = time.perf_counter_ns()
+        latest = read_libvirt()
+        latest['libvirt_rpc_ns'] = time.perf_counter_ns() - begin
+        self.latest = latest # Swapped at once for the other consumers
+
+class DisplayConsumer(Consumer):
+    """Live display of the last record of each batch"""
+
+    def __init__(self, ring : SampleRing, libvirt : LibvirtConsumer = None):
+        super().__init__(ring=ring, name='display')
+        self.libvirt = libvirt
+
+    def handle(self, records : list):
+        record = records[-1]
+        rapl_measures, cpu_measures, estimation_measures = record.rapl, record.cpu, record.estimation
+        libvirt_measures = self.libvirt.latest if self.libvirt is not None else dict()
+        if not rapl_measures: return
         max_domain_length = len(max(list(rapl_measures.keys()), key=len))
         max_measure_length = len(max([str(value) for value in rapl_measures.values()], key=len))
+        rolling = store.rolling(metrics=[domain for domain in rapl_measures.keys() if domain.endswith('-watt')], seconds=STORE_DISPLAY_WINDOW)
         for domain, measure in rapl_measures.items():
             usage_complement = ''
             for package, cpu_usage in cpu_measures.items():
                 if domain in package:
                     usage_complement+= '- ' + str(cpu_usage) + '%'
                     break
+            if domain in rolling: # Power over the last seconds
+                usage_complement = '(' + str(STORE_DISPLAY_WINDOW) + 's mean ' + str(round(rolling[domain]['mean'], PRECISION)) + ' p95 ' + str(round(rolling[domain]['p95'], PRECISION)) + \
+                    ' min ' + str(round(rolling[domain]['min'], PRECISION)) + ' max ' + str(round(rolling[domain]['max'], PRECISION)) + ') ' + usage_complement
             print(domain.ljust(max_domain_length), str(measure).ljust(max_measure_length), 'W', usage_complement)
-        if libvirt_measures: print('Libvirt:', libvirt_measures['libvirt_vm_count'], 'vm(s)', libvirt_measures['libvirt_vm_cpu_cml'], 'cpu(s)', libvirt_measures['libvirt_vm_mem_cml'], 'MB')
+        if 'libvirt_vm_count' in libvirt_measures: print('Libvirt:', libvirt_measures['libvirt_vm_count'], 'vm(s)', libvirt_measures['libvirt_vm_cpu_cml'], 'cpu(s)', libvirt_measures['libvirt_vm_mem_cml'], 'MB')
+        for metric, value in estimation_measures.items():
+            if metric.endswith('_top-down'): print(metric.replace('_top-down', ''), value, 'W', '(ratio', str(estimation_measures.get(metric.replace('_top-down', '_ratio'))) + ')')
+        if record.cache: display_cache_usage(cache_domains=cache_domains, cache_measures=record.cache)
         print('---')
 
-    # Dump reading
-    with open(output_file, 'a') as f:
-        for domain, measure in misc.items():
-            f.write(str(time_since_launch) + ',' + domain + ',' + str(measure) + OUTPUT_NL)
-        for domain, measure in rapl_measures.items():
-            f.write(str(time_since_launch) + ',' + domain + ',' + str(measure) + OUTPUT_NL)
-        for cpuid, measure in cpu_measures.items():
-            f.write(str(time_since_launch) + ',' + cpuid + ',' + str(measure) + OUTPUT_NL)
-        for metric, value in libvirt_measures.items():
-            f.write(str(time_since_launch) + ',' + metric + ',' + str(value) + OUTPUT_NL)
+class WriterConsumer(Consumer):
+    """Write each record to the output of the current phase, enriched with the latest libvirt statistics and with
+    the state of the pipeline (backlog and records dropped per consumer)"""
+
+    def __init__(self, ring : SampleRing, pipeline):
+        super().__init__(ring=ring, name='writer')
+        self.pipeline = pipeline
+
+    def handle(self, records : list):
+        libvirt_measures = self.pipeline.libvirt.latest if self.pipeline.libvirt is not None else dict()
+        pipeline_measures = self.pipeline.measures()
+        for record in records:
+            output_writer.write(timestamp=record.timestamp, measures=record.measures(libvirt_measures=libvirt_measures, pipeline_measures=pipeline_measures))
+
+class SamplePipeline(object):
+    """Decouple the sampling loop from its outputs: each tick is pushed to a ring consumed by the writer, the live
+    display and the libvirt collection on their own threads, so that slow disks or RPCs do not delay the next tick"""
+
+    def __init__(self, size : int = PIPELINE_RING):
+        self.ring = SampleRing(size=size)
+        self.libvirt = LibvirtConsumer(ring=self.ring) if VM_CONNECTOR is not None else None
+        self.consumers = [self.libvirt] if self.libvirt is not None else list()
+        self.writer = WriterConsumer(ring=self.ring, pipeline=self)
+        self.consumers.append(self.writer)
+        if LIVE_DISPLAY: self.consumers.append(DisplayConsumer(ring=self.ring, libvirt=self.libvirt))
+        for consumer in self.consumers: consumer.start()
+
+    def push(self, record : SampleRecord):
+        self.ring.put(record)
+
+    def measures(self):
+        measures = {'pipeline_backlog': max(consumer.backlog() for consumer in self.consumers)}
+        for consumer in self.consumers: measures['pipeline_dropped_' + consumer.name] = consumer.dropped
+        return measures
+
+    def drain(self):
+        """Wait until the writer handled all records pushed so far. The display and libvirt consumers are not waited
+        for: when late, they keep dropping records instead of stalling the sampling loop"""
+        with self.ring.condition:
+            self.ring.condition.wait_for(lambda: self.writer.cursor == self.ring.head)
+
+    def summary(self):
+        dropped = {consumer.name: consumer.dropped for consumer in self.consumers if consumer.dropped}
+        if dropped: print('Warning: samples dropped by slow consumers', dropped)
+
+###########################################
+# Time series store
+###########################################
+
+class TimeSeriesStore(object):
+    """Last capacity samples of each numerical metric, in memory: a preallocated float64 matrix with one row per metric
+    (metric names are interned to row ids) used as a ring along columns, np.nan when a metric is missing on a tick.
+    Memory does not depend on the duration of the run"""
+
+    def __init__(self, capacity : int = STORE_CAPACITY, max_metrics : int = STORE_METRICS):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((max_metrics, capacity), np.nan, dtype=np.float64)
+        self.ids = dict() # metric -> row
+        self.count = 0 # samples appended since clear()
+        self.lock = threading.Lock() # Appended by the sampling loop, read by the display
+        self.overflow = False
+
+    def intern(self, metric : str):
+        if metric not in self.ids:
+            if len(self.ids) == len(self.values):
+                if not self.overflow: print('Warning: more than', len(self.values), 'metrics, extra ones are not kept in memory')
+                self.overflow = True
+                return None
+            self.ids[metric] = len(self.ids)
+        return self.ids[metric]
+
+    def append(self, timestamp : int, measures : dict):
+        with self.lock:
+            position = self.count % self.capacity
+            self.timestamps[position] = timestamp
+            self.values[:, position] = np.nan
+            for metric, value in measures.items():
+                if isinstance(value, str) or value is None: continue
+                row = self.intern(metric)
+                if row is not None: self.values[row, position] = value
+            self.count+=1
+
+    def clear(self):
+        with self.lock: self.count = 0
+
+    def __positions(self, seconds : float = None, last : int = None):
+        """Columns of the window, oldest first: the last samples, or the samples of the last seconds"""
+        size = min(self.count, self.capacity) if last is None else min(self.count, self.capacity, last)
+        positions = np.arange(self.count - size, self.count) % self.capacity
+        if seconds is not None and size:
+            positions = positions[self.timestamps[positions] >= self.timestamps[positions[-1]] - seconds*10**9]
+        return positions
+
+    def window(self, metrics : list, seconds : float = None, last : int = None):
+        """Return the timestamps of the window and a matrix of the values of each metric (np.nan if unknown)"""
+        with self.lock:
+            positions = self.__positions(seconds=seconds, last=last)
+            rows = [self.ids.get(metric) for metric in metrics]
+            matrix = np.full((len(metrics), len(positions)), np.nan)
+            known = [index for index, row in enumerate(rows) if row is not None]
+            matrix[known] = self.values[np.ix_([rows[index] for index in known], positions)]
+            return self.timestamps[positions].copy(), matrix
+
+    def rolling(self, metrics : list, seconds : float = None, last : int = None):
+        """Statistics of each metric on the window, computed on all metrics at once (missing values are ignored)"""
+        _, matrix = self.window(metrics=metrics, seconds=seconds, last=last)
+        with warnings.catch_warnings(): # Metrics without any value on the window
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            count = (~np.isnan(matrix)).sum(axis=1)
+            mean = np.nanmean(matrix, axis=1) if matrix.shape[1] else np.full(len(metrics), np.nan)
+            std = np.nanstd(matrix, axis=1, ddof=1) if matrix.shape[1] else np.full(len(metrics), np.nan)
+            percentiles = np.nanpercentile(matrix, [50, 95], axis=1) if matrix.shape[1] else np.full((2, len(metrics)), np.nan)
+            minimum = np.nanmin(matrix, axis=1) if matrix.shape[1] else np.full(len(metrics), np.nan)
+            maximum = np.nanmax(matrix, axis=1) if matrix.shape[1] else np.full(len(metrics), np.nan)
+        return {metric: {'count': int(count[index]), 'mean': mean[index], 'std': std[index], 'p50': percentiles[0][index],
+                         'p95': percentiles[1][index], 'min': minimum[index], 'max': maximum[index]} for index, metric in enumerate(metrics)}
+
+rapl_hist, cpu_hist, output_writer, launch_at, last_call, next_deadline = {}, {}, None, 0, 0, 0
+rapl_reader, freq_reader, overhead, cache_domains, pipeline, rapl_range, store = None, None, None, None, None, None, None
+def wait_next_tick(period : float):
+    """Sleep until the next absolute deadline on CLOCK_MONOTONIC (deadlines do not drift with the duration of a
+    tick). Whole periods already missed are skipped. Return the tick time (ns), its jitter (ns) and skipped ticks"""
+    global next_deadline
+    period_ns = int(period*10**9)
+    now = CLOCK()
+    if next_deadline == 0: next_deadline = now + period_ns
+    skipped = 0
+    if period_ns > 0 and now >= next_deadline + period_ns:
+        skipped = (now - next_deadline) // period_ns
+        next_deadline += skipped * period_ns
+        print('Warning: overlap iteration,', skipped, 'tick(s) skipped')
+    if next_deadline > now: time.sleep((next_deadline - now)/10**9) # clock_nanosleep on CLOCK_MONOTONIC
+    tick = CLOCK()
+    jitter = tick - next_deadline
+    next_deadline = next_deadline + period_ns if period_ns > 0 else 0
+    return tick, jitter, skipped
+
+def close_output():
+    global output_writer
+    if pipeline is not None: pipeline.drain() # Pending records belong to the phase being closed
+    if output_writer is not None: output_writer.close()
+    output_writer = None
+    if overhead is not None: overhead.summary()
+    if pipeline is not None: pipeline.summary()
+
+def read_system(label : str, rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, misc : dict = {}, repetition : int = 1, sleep : float = 0, init : bool = False, monitor_process_params : dict = None, estimation_params : dict = None, resume : tuple = None):
+    """Sample the system repetition times, every sleep seconds. init starts a new phase, resume=(position, elapsed ns)
+    re-opens a phase at a checkpoint: its output is truncated there and timestamps continue from elapsed"""
+    global rapl_hist, cpu_hist, output_writer, launch_at, last_call, next_deadline, rapl_reader, freq_reader, overhead, cache_domains, pipeline, rapl_range, store
+    if rapl_reader is None: rapl_reader, rapl_range = SysfsReader(paths=rapl_sysfs), find_rapl_range(rapl_sysfs) # Files are opened once for the whole run
+    if freq_reader is None: freq_reader = open_freq_reader(cpuid_per_numa)
+    if overhead is None: overhead = SelfOverhead()
+    if PER_CACHE_USAGE and cache_domains is None: cache_domains = CacheDomains(cache_topo)
+    if store is None: store = TimeSeriesStore()
+    if pipeline is None: pipeline = SamplePipeline()
+    if init or resume is not None:
+        rapl_hist = {name:None for name in rapl_sysfs.keys()}
+        rapl_hist['time'] = None # for joule to watt conversion
+        rapl_hist['total'] = dict() # uJ accumulated since the (re)start of the phase
+        cpu_hist = {}
+        launch_at = CLOCK() - (resume[1] if resume is not None else 0)
+        last_call = 0
+        next_deadline = 0 # First tick after a whole period
+        close_output() # Previous phase
+        overhead.reset(label=label)
+        store.clear() # Timestamps restart with the phase
+        output_writer = OUTPUT_WRITERS[OUTPUT_FORMAT](label=label, init=True, position=resume[0] if resume is not None else None)
+        if resume is not None: # Rebuild counter history so that the first tick has a delta
+            read_rapl(rapl_reader=rapl_reader, hist=rapl_hist, current_time=CLOCK(), energy_range=rapl_range)
+            read_cpu_usage(cpuid_per_numa=cpuid_per_numa, hist=cpu_hist, freq_reader=freq_reader)
+    elif output_writer is None: # Append to an existing phase
+        overhead.reset(label=label)
+        output_writer = OUTPUT_WRITERS[OUTPUT_FORMAT](label=label, init=False)
+
+    for _ in range(repetition):
+        last_call, jitter, skipped = wait_next_tick(period=sleep)
+
+        overhead.begin()
+        rapl_measures = read_rapl(rapl_reader=rapl_reader, hist=rapl_hist, current_time=last_call, energy_range=rapl_range)
+        overhead.lap('rapl')
+        cpu_measures  = dict()
+        for key, value in read_cpu_usage(cpuid_per_numa=cpuid_per_numa, hist=cpu_hist, freq_reader=freq_reader).items(): cpu_measures[key] = value
+        overhead.lap('cpu')
+        # Duration of each batch of sysfs reads, to check that sampling overhead does not grow with core count
+        sampler_measures = {'sampler_rapl_ns': rapl_reader.last_batch_ns, 'sampler_freq_ns': freq_reader.last_batch_ns,
+                            'sampler_jitter_ns': jitter, 'sampler_skipped_ticks': skipped}
+        cache_measures = dict()
+        if PER_CACHE_USAGE:
+            cache_measures = cache_domains.measures(cputime_hist=cpu_hist)
+            overhead.lap('cache')
+
+        if monitor_process_params is not None:
+            monitor_process(**monitor_process_params)
+            overhead.lap('process')
+        estimation_measures = dict()
+        if estimation_params is not None:
+            estimation_measures = estimate_vm_power(rapl_measures=rapl_measures, cpu_measures=cpu_measures, **estimation_params)
+            overhead.lap('estimation')
+        sampler_measures.update(overhead.measures(tick=last_call))
+        output_begin = time.perf_counter_ns()
+        output(rapl_measures=rapl_measures, cpu_measures=cpu_measures, cache_measures=cache_measures, misc=misc, sampler_measures=sampler_measures, estimation_measures=estimation_measures, time_since_launch=last_call-launch_at)
+        overhead.end_output(begin=output_begin)
+
+def output(rapl_measures : dict, cpu_measures : dict, cache_measures : dict, misc : dict, sampler_measures : dict, estimation_measures : dict, time_since_launch : int): # time_since_launch in ns
+    """Push the measures of a tick to the pipeline (display and writes happen on the consumer threads)"""
+    record = SampleRecord(timestamp=time_since_launch, misc=dict(misc), rapl=rapl_measures, cpu=cpu_measures, cache=cache_measures,
+                          sampler=sampler_measures, estimation=estimation_measures)
+    store.append(timestamp=time_since_launch, measures=record.measures())
+    pipeline.push(record)
+
+###########################################
+# Load generation
+###########################################
+
+def load_worker(index : int, cpu : int, duty, condition, stop, state):
+    """Busy loop pinned on cpu for duty[index] % of each LOAD_PERIOD. An idle worker waits for the next level change.
+    state[index] is set to 1 once pinned, to -errno if the cpu cannot be used (cpuset restriction, offline cpu...)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Interruptions are handled by the controller
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except OSError as err:
+        state[index] = -(err.errno or 1)
+        return
+    state[index] = 1
+    controller = multiprocessing.parent_process()
+    while not stop.is_set() and controller.is_alive(): # Also exit if the controller was killed
+        with condition:
+            if duty[index] <= 0:
+                condition.wait(timeout=1)
+                continue
+        begin = time.monotonic()
+        busy = LOAD_PERIOD * min(duty[index], 100) / 100
+        while time.monotonic() - begin < busy: pass
+        remaining = LOAD_PERIOD - (time.monotonic() - begin)
+        if remaining > 0: time.sleep(remaining)
+
+class LoadController(object):
+    """Pool of load workers started once, one per cpu pinned in cpuid_per_numa order. Levels are set through a shared
+    duty cycle array, as if unpinned stress-ng workers of a given load percentage had been spread over the cpus"""
+
+    def __init__(self, cpuid_per_numa : dict):
+        context = multiprocessing.get_context('forkserver') # Forking this process is unsafe once libvirt or pipeline threads run
+        self.cpus = [int(cpu[3:]) for cpuid_list in cpuid_per_numa.values() for cpu in cpuid_list]
+        self.duty = context.Array('d', len(self.cpus), lock=False) # Written under condition
+        self.condition = context.Condition()
+        self.stop = context.Event()
+        self.state = context.Array('i', len(self.cpus), lock=False) # Set by each worker once started
+        self.workers = list()
+        for index, cpu in enumerate(self.cpus):
+            worker = context.Process(target=load_worker, args=(index, cpu, self.duty, self.condition, self.stop, self.state), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        atexit.register(self.close)
+        deadline = time.monotonic() + LOAD_START_TIMEOUT
+        while 0 in self.state[:] and time.monotonic() < deadline: time.sleep(0.01)
+        self.check()
+
+    def check(self):
+        """Abort if a worker is not running pinned on its cpu: the load of that cpu would silently be missing"""
+        for index, cpu in enumerate(self.cpus):
+            if self.state[index] < 0: error = 'cannot be pinned (' + os.strerror(-self.state[index]) + ')'
+            elif self.state[index] == 0: error = 'did not start'
+            elif not self.workers[index].is_alive(): error = 'exited'
+            else: continue
+            self.close()
+            raise SystemExit('Load worker of cpu' + str(cpu) + ' ' + error + ', aborting as its load would be missing from the measures')
+
+    def set_load(self, workers : int, load_percentage : float):
+        """Load the host as workers stress-ng processes of load_percentage would: worker k goes to the cpu k modulo the
+        number of cpus (e.g. 10 workers of 25% on 8 cpus: 50% on the first two cpus, 25% on the others)"""
+        per_cpu = workers // len(self.cpus) + (np.arange(len(self.cpus)) < workers % len(self.cpus))
+        duty = np.minimum(per_cpu * load_percentage, 100)
+        self.check()
+        with self.condition:
+            self.duty[:] = duty.tolist()
+            self.condition.notify_all()
+
+    def close(self):
+        if not self.workers: return
+        self.stop.set()
+        with self.condition: self.condition.notify_all()
+        for worker in self.workers: worker.join(timeout=2*LOAD_PERIOD)
+        for worker in self.workers:
+            if worker.is_alive(): worker.terminate()
+        self.workers = list()
+
+load_controller = None
 
 ###########################################
 # Main functions
@@ -460,16 +1403,117 @@ def core_number(cpuid_per_numa : dict):
     for cpuid in cpuid_per_numa.values(): size+=len(cpuid)
     return size
 
+def is_stable(last : int):
+    """Check whether the 95% confidence interval half-width of each ADAPTIVE_METRICS on the last samples of the store
+    is within ADAPTIVE_TOLERANCE"""
+    rolling = store.rolling(metrics=list(ADAPTIVE_METRICS.keys()), last=last)
+    for metric, scale in ADAPTIVE_METRICS.items():
+        count = rolling[metric]['count']
+        if count < 2: return False
+        student = STUDENT_T95[count-2] if count-2 < len(STUDENT_T95) else 1.96
+        half_width = student * rolling[metric]['std'] / np.sqrt(count)
+        reference = scale if scale is not None else abs(rolling[metric]['mean'])
+        if half_width > ADAPTIVE_TOLERANCE * reference: return False
+    return True
+
+def read_step(misc : dict, init : bool = False, resume : tuple = None, **read_system_params):
+    """Measure a step: MODEL_ITERATION ticks or, in adaptive mode, ticks until is_stable(). In adaptive mode, each tick
+    records its rank in the step as step_sample (the last one holds the number of samples used). Return the number of ticks"""
+    if ADAPTIVE_TOLERANCE is None:
+        read_system(misc=misc, repetition=MODEL_ITERATION, sleep=MODEL_MEASURE_WINDOW, init=init, resume=resume, **read_system_params)
+        return MODEL_ITERATION
+    for count in range(1, ADAPTIVE_MAX+1):
+        misc['step_sample'] = count
+        first = count == 1
+        read_system(misc=misc, repetition=1, sleep=MODEL_MEASURE_WINDOW, init=init and first, resume=resume if first else None, **read_system_params)
+        if count >= ADAPTIVE_MIN and is_stable(last=count): break
+    if LIVE_DISPLAY: print('step stopped after', count, 'samples')
+    return count
+
+def step_iteration():
+    """Samples per step to be budgeted: the fixed count, or the upper bound in adaptive mode"""
+    return MODEL_ITERATION if ADAPTIVE_TOLERANCE is None else ADAPTIVE_MAX
+
+def campaign_duration(host_core : int, iteration : int):
+    """Duration (s) of the three training levels and of the two VM scenarios with iteration samples per step"""
+    duration = 0
+    for load_percentage in MODEL_STEP:
+        duration += int(host_core * (100/load_percentage) * MODEL_MEASURE_WINDOW * iteration)
+    duration += int((host_core * (100/MODEL_STEP[0]) * MODEL_MEASURE_WINDOW * iteration)*2)
+    return duration
+
+class Campaign(object):
+    """Manifest of the phases and load steps already measured, saved after each step so that an interrupted campaign
+    can be resumed. For each phase: completed steps, output position and elapsed time (ns) at the last checkpoint"""
+
+    def __init__(self, path : str, parameters : dict, resume : bool):
+        self.path = path
+        self.parameters = parameters
+        self.phases = dict()
+        if resume and exists(path):
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+            if manifest['parameters'] == parameters: self.phases = manifest['phases']
+            else: print('Warning: manifest', path, 'was recorded with other parameters, starting from scratch')
+        self.save()
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f: # manifest is either the previous or the new one
+            json.dump({'parameters': self.parameters, 'phases': self.phases}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def is_done(self, label : str):
+        """Phase already complete, with its output still as it was at completion"""
+        phase = self.phases.get(label)
+        return phase is not None and phase['done'] and OUTPUT_WRITERS[OUTPUT_FORMAT].is_valid(label, phase['position'])
+
+    def resume_point(self, label : str):
+        """Return the count of steps completed and the (position, elapsed) checkpoint to resume from (None if none)"""
+        phase = self.phases.get(label)
+        if phase is None or phase['done'] or phase['steps'] == 0: return 0, None
+        if not OUTPUT_WRITERS[OUTPUT_FORMAT].can_resume(label, phase['position']):
+            print('Warning: output of', label, 'is shorter than its checkpoint, restarting the phase')
+            return 0, None
+        return phase['steps'], (phase['position'], phase['elapsed'])
+
+    def checkpoint(self, label : str, steps : int, done : bool = False):
+        """Record that steps are complete. Unless the phase is done, the manifest is only updated once the writer
+        flushed these steps by itself: forcing a flush per step would write a tiny batch (or npz chunk) each time"""
+        if output_writer is not None and output_writer.label == label:
+            pipeline.drain() # Writer is only used by its consumer thread otherwise
+            if done:
+                position, elapsed = output_writer.checkpoint(), last_call - launch_at
+            else:
+                output_writer.mark((steps, last_call - launch_at))
+                if output_writer.durable is None: return # Nothing flushed at a step boundary yet
+                (steps, elapsed), position = output_writer.durable
+        else: # Nothing measured since resume
+            position, elapsed = self.phases[label]['position'], self.phases[label]['elapsed']
+        phase = {'steps': steps, 'done': done, 'position': position, 'elapsed': elapsed}
+        if self.phases.get(label) == phase: return
+        self.phases[label] = phase
+        self.save()
+
+campaign = None
+
 def noise(rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, label : str, load_percentage : int, monitor_process_params : dict = None):
     target_level = 0
     size = core_number(cpuid_per_numa)
+    completed, resume = campaign.resume_point(label) if campaign is not None else (0, None)
+    if completed: print('Resuming', label, 'after', completed, 'steps')
+    step = 0
 
     # Capture idle
     if LIVE_DISPLAY: print('gen_model target 0%')
 
-    misc = {'phase':label,'target':0}
-    if monitor_process_params is not None: monitor_process_params['output_dict'] = misc
-    read_system(label=label, rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc=misc, repetition=MODEL_ITERATION, sleep=MODEL_MEASURE_WINDOW, init=True, monitor_process_params=monitor_process_params)
+    if step >= completed:
+        misc = {'phase':label,'target':0}
+        if monitor_process_params is not None: monitor_process_params['output_dict'] = misc
+        read_step(label=label, rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc=misc, init=True, monitor_process_params=monitor_process_params)
+        if campaign is not None: campaign.checkpoint(label=label, steps=step+1)
+    step+=1
 
     # Capture workload
     for numa in cpuid_per_numa.keys():
@@ -477,69 +1521,79 @@ def noise(rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, label : s
             for _ in range(int(100/load_percentage)):
                 target_level+=1
                 target_level_percentage = int(round((target_level/(size/(load_percentage/100))),2)*100)
+                if step < completed: # Already measured
+                    step+=1
+                    continue
                 if LIVE_DISPLAY: print(label, 'target', target_level_percentage, '%')
-                process_to_kill.append(subprocess.Popen("stress-ng -c 1 -l " + str(load_percentage), shell=True, preexec_fn=setsid))
+                load_controller.set_load(workers=target_level, load_percentage=load_percentage)
 
                 misc={'phase':label,'target':target_level_percentage}
                 if monitor_process_params is not None: monitor_process_params['output_dict'] = misc
-                read_system(label=label, rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc=misc, repetition=MODEL_ITERATION, sleep=MODEL_MEASURE_WINDOW, init=False, monitor_process_params=monitor_process_params)
-    for process in process_to_kill: killpg(getpgid(process.pid), signal.SIGTERM)
+                read_step(label=label, rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc=misc, init=False, resume=resume if step == completed else None, monitor_process_params=monitor_process_params)
+                if campaign is not None: campaign.checkpoint(label=label, steps=step+1)
+                step+=1
+    if campaign is not None: campaign.checkpoint(label=label, steps=step, done=True)
+    load_controller.set_load(workers=0, load_percentage=load_percentage)
 
 def launch_vm(label : str, host_core : int, load_percentage : int):
-    estimated_duration = int(host_core * (100/load_percentage) * MODEL_MEASURE_WINDOW * MODEL_ITERATION)
+    estimated_duration = int(host_core * (100/load_percentage) * MODEL_MEASURE_WINDOW * step_iteration()) # VM must outlive the longest run
     subprocess.Popen("bash/launchvm.sh " + str(host_core) + " " + str(estimated_duration), shell=True,  preexec_fn=setsid)
-    process_label = {}
+    scanner = ProcessScanner(keyword='qemu')
     MAX_TRY = 10
     for i in range(MAX_TRY):
-        pid = find_process(keyword='qemu')
-        if pid is not None:
-            all_child_process = get_child_process(pid)
-            vcpu_process = list()
-            for child_process in all_child_process:
-                name = get_pid_name(child_process)
-                if 'CPU' in name :
-                    process_label[str(child_process)] = name.replace('/KVM', '')
-                    vcpu_process.append(child_process)
-
+        if scanner.scan():
             print('VM found, waiting for it to be ready to serve')
             while not does_file_exist(file='/tmp/vmready-sync', to_be_removed=True):
                 time.sleep(1)
             print('VM is ready to serve')
-            return {pid: vcpu_process}, process_label
+            return scanner
 
         print('Unable to find VM, re-trying in 15s [', i+1, '/', MAX_TRY, ']')
         time.sleep(15)
     print('Failed to launch VM on step', label,  'exiting')
+    close_output()
     sys.exit(-1)
 
 def gen_model(rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, load_percentage : int, label : str):
+    if campaign is not None and campaign.is_done(label): return print('Skipping', label, '(already complete)')
     print("Launching", label)
     noise(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, load_percentage=load_percentage, label=label)
 
 def gen_exp(rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, label : str, with_noise : bool = False):
+    if campaign is not None and campaign.is_done(label): return print('Skipping', label, '(already complete)')
     print("Launching", label)
     # Launch VM
-    process_as_dict, process_label = launch_vm(label=label, host_core=core_number(cpuid_per_numa), load_percentage=MODEL_STEP[0])
+    scanner = launch_vm(label=label, host_core=core_number(cpuid_per_numa), load_percentage=MODEL_STEP[0])
     # Capture
     if with_noise:
-        monitor_process_params = {'process_as_dict':process_as_dict, 'replace_pid_per_label': process_label, 'output_dict': {}}
+        monitor_process_params = {'scanner':scanner, 'output_dict': {}}
         noise(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, load_percentage=MODEL_STEP[0], label=label,monitor_process_params=monitor_process_params)
         return
     else:
         first_call = True
-        while find_process(keyword='qemu') is not None:
+        while scanner.scan(): # Until all VMs are stopped
             misc = {'phase':label}
-            monitor_process_params = {'process_as_dict':process_as_dict, 'replace_pid_per_label': process_label, 'output_dict': misc}
+            monitor_process_params = {'scanner':scanner, 'output_dict': misc}
             read_system(label=label, rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc=misc, repetition=MODEL_ITERATION, sleep=MODEL_MEASURE_WINDOW, init=first_call, monitor_process_params=monitor_process_params)
             first_call=False
+        if campaign is not None and not first_call: campaign.checkpoint(label=label, steps=1, done=True) # VM lifetime cannot be resumed
+
+def estimate(rapl_sysfs : dict, cpuid_per_numa : dict, cache_topo : dict, model : dict):
+    print('Launching online estimation with a model of degree', model['degree'], 'fitted on', model['core_host'], 'cores')
+    if model['core_host'] != core_number(cpuid_per_numa): print('Warning: model was fitted on a host with', model['core_host'], 'cores, this one has', core_number(cpuid_per_numa))
+    estimation_params = {'model': model, 'scanner': ProcessScanner(keyword='qemu')}
+    first_call = True
+    while True: # Until interrupted
+        read_system(label='estimation', rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, misc={'phase':'estimation'}, repetition=MODEL_ITERATION, sleep=MODEL_MEASURE_WINDOW, init=first_call, estimation_params=estimation_params)
+        first_call = False
 
 ###########################################
 # Entrypoint, manage arguments
 ###########################################
 if __name__ == '__main__':
 
-    short_options = 'hlecdv:o:p:'
-    long_options = ['help', 'live', 'explicit', 'cache', 'vm=', 'delay=', 'output=', 'precision=']
+    short_options = 'hlecd:v:o:p:f:'
+    long_options = ['help', 'live', 'explicit', 'cache', 'vm=', 'delay=', 'output=', 'precision=', 'format=', 'flush=', 'estimate=', 'tolerance=', 'min=', 'max=', 'resume', 'no-vcpu', 'topology=', 'rescan']
 
     try:
         arguments, values = getopt.getopt(sys.argv[1:], short_options, long_options)
@@ -556,39 +1610,79 @@ if __name__ == '__main__':
             PER_CACHE_USAGE = True
         elif current_argument in('-v', '--vm'):
             import libvirt
+            libvirt.virEventRegisterDefaultImpl() # Lifecycle events invalidate cached domain attributes
             VM_CONNECTOR = libvirt.open(current_value)
             if not VM_CONNECTOR: raise SystemExit('Failed to open connection to ' + current_value)
+            watch_libvirt_lifecycle(VM_CONNECTOR)
         elif current_argument in('-o', '--output'):
             OUTPUT_PREFIX= current_value
         elif current_argument in('-p', '--precision'):
             PRECISION= int(current_value)
+        elif current_argument in('-f', '--format'):
+            if current_value not in OUTPUT_WRITERS: raise SystemExit('Unknown output format ' + current_value)
+            OUTPUT_FORMAT= current_value
+        elif current_argument == '--flush':
+            OUTPUT_FLUSH_DELAY= float(current_value)
+        elif current_argument in('-d', '--delay'):
+            MODEL_MEASURE_WINDOW= float(current_value)
+        elif current_argument == '--estimate':
+            ESTIMATION_MODEL= load_model(current_value)
+        elif current_argument == '--tolerance':
+            ADAPTIVE_TOLERANCE= float(current_value)
+        elif current_argument == '--min':
+            ADAPTIVE_MIN= max(2, int(current_value)) # a confidence interval needs two samples
+        elif current_argument == '--max':
+            ADAPTIVE_MAX= int(current_value)
+        elif current_argument == '--resume':
+            RESUME= True
+        elif current_argument == '--no-vcpu':
+            VCPU_DETAIL= False
+        elif current_argument == '--topology':
+            TOPOLOGY_SNAPSHOT= current_value if current_value else None
+        elif current_argument == '--rescan':
+            TOPOLOGY_RESCAN= True
 
     try:
         # Find sysfs
         rapl_sysfs=find_rapl_sysfs()
-        cpuid_per_numa=find_cpuid_per_numa()
-        cache_topo=find_cache_topo()
-        process_to_kill=list()
+        topology=find_topology()
+        cpuid_per_numa=topology.cpuid_per_numa()
+        cache_topo=topology.cache_topo()
         print('>RAPL domain found:')
         max_domain_length = len(max(list(rapl_sysfs.keys()), key=len))
         for domain, location in rapl_sysfs.items(): print(domain.ljust(max_domain_length), location)
         print('>NUMA topology found:')
         for numa_id, cpu_list in cpuid_per_numa.items(): print('socket-' + str(numa_id) + ':', len(cpu_list), 'cores')
         print('')
-        
-        estimated_duration = 0
-        for load_percentage in MODEL_STEP:
-            estimated_duration += int(core_number(cpuid_per_numa) * (100/load_percentage) * MODEL_MEASURE_WINDOW * MODEL_ITERATION)
-        estimated_duration += int((core_number(cpuid_per_numa) * (100/MODEL_STEP[0]) * MODEL_MEASURE_WINDOW * MODEL_ITERATION)*2)
 
-        print('Launching experiment', OUTPUT_PREFIX, 'with parameters:', MODEL_STEP, '%(load per step)', 'on', core_number(cpuid_per_numa), 'cores with', MODEL_ITERATION, 'measures of', MODEL_MEASURE_WINDOW, 's, expected duration:', estimated_duration, 's')
+        if ESTIMATION_MODEL is not None:
+            estimate(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, model=ESTIMATION_MODEL)
+
+        if ADAPTIVE_TOLERANCE is None:
+            estimated_duration = campaign_duration(host_core=core_number(cpuid_per_numa), iteration=MODEL_ITERATION)
+            print('Launching experiment', OUTPUT_PREFIX, 'with parameters:', MODEL_STEP, '%(load per step)', 'on', core_number(cpuid_per_numa), 'cores with', MODEL_ITERATION, 'measures of', MODEL_MEASURE_WINDOW, 's, expected duration:', estimated_duration, 's')
+        else:
+            min_duration = campaign_duration(host_core=core_number(cpuid_per_numa), iteration=ADAPTIVE_MIN)
+            max_duration = campaign_duration(host_core=core_number(cpuid_per_numa), iteration=ADAPTIVE_MAX)
+            print('Launching experiment', OUTPUT_PREFIX, 'with parameters:', MODEL_STEP, '%(load per step)', 'on', core_number(cpuid_per_numa), 'cores with', ADAPTIVE_MIN, 'to', ADAPTIVE_MAX, 'measures of', MODEL_MEASURE_WINDOW, 's until a', ADAPTIVE_TOLERANCE, 'tolerance, expected duration: between', min_duration, 'and', max_duration, 's')
+        parameters = {'step': MODEL_STEP, 'delay': MODEL_MEASURE_WINDOW, 'iteration': MODEL_ITERATION, 'tolerance': ADAPTIVE_TOLERANCE,
+                      'min': ADAPTIVE_MIN, 'max': ADAPTIVE_MAX, 'format': OUTPUT_FORMAT, 'cores': core_number(cpuid_per_numa)}
+        campaign = Campaign(path=OUTPUT_PREFIX + '-manifest.json', parameters=parameters, resume=RESUME)
+        load_controller = LoadController(cpuid_per_numa=cpuid_per_numa)
         for load_percentage in MODEL_STEP:
             gen_model(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, load_percentage=load_percentage, label='training-' + str(load_percentage))
 
         gen_exp(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, label='groundtruth', with_noise=False)
         gen_exp(rapl_sysfs=rapl_sysfs, cpuid_per_numa=cpuid_per_numa, cache_topo=cache_topo, label='cloudlike', with_noise=True)
+        close_output()
+        load_controller.close()
 
     except KeyboardInterrupt:
-        for process in process_to_kill: killpg(getpgid(process.pid), signal.SIGTERM)
+        close_output()
+        if load_controller is not None: load_controller.close()
         print('Program interrupted')
         sys.exit(0)
+    except SystemExit: # e.g. a load worker failed: keep what was measured so far
+        close_output()
+        if load_controller is not None: load_controller.close()
+        raise
@@ -0,0 +1 @@
+"""Offline part of Cinergy: load the datasets generated by cinergy-model.py, fit and evaluate power models"""
@@ -0,0 +1,54 @@
+import numpy as np
+
+def __polynomial(model, include_static : bool = True):
+    """Power series of a model (PowerModel or (intercept, coef) tuple) with the intercept folded in degree 0"""
+    intercept, coefficients = model
+    series = np.array(coefficients, dtype=np.float64)
+    if include_static: series[0] += intercept
+    return series
+
+def predict(model, x, include_static : bool = True):
+    """Evaluate a model on an array of host usage values of any shape, using the Horner scheme"""
+    return np.polynomial.polynomial.polyval(np.asarray(x, dtype=np.float64), __polynomial(model, include_static))
+
+def estimate(model, vm_usage, core_host : int = None, include_static : bool = True):
+    """Evaluate a model on VM usage: with core_host, VM usage (in % of a core, e.g. 400 for 4 busy vCPUs) is first
+    normalised to host usage. vm_usage may be 2-D (e.g. samples x VMs)"""
+    x = np.asarray(vm_usage, dtype=np.float64)
+    if core_host is not None: x = x / core_host
+    return predict(model, x, include_static=include_static)
+
+def estimate_hosts(models : list, vm_usage, core_hosts : list = None, include_static : bool = True):
+    """Evaluate one model per host in a single call: row i of vm_usage (hosts x samples) is evaluated with models[i],
+    normalised by core_hosts[i] if given"""
+    x = np.asarray(vm_usage, dtype=np.float64)
+    if core_hosts is not None: x = x / np.asarray(core_hosts, dtype=np.float64)[:, None]
+    series = [__polynomial(model, include_static) for model in models]
+    stacked = np.zeros((len(series), max(len(serie) for serie in series))) # Degrees differ, pad with 0
+    for index, serie in enumerate(series): stacked[index, :len(serie)] = serie
+    result = np.zeros_like(x)
+    for degree in range(stacked.shape[1]-1, -1, -1): # Horner, vectorized over hosts and samples
+        result = result * x + stacked[:, degree, None]
+    return result
+
+def match_closest(source_df, col : str, target_df, val : str, threshold : float = 0.001):
+    """For each row of target_df, return the val of the source_df row whose col is the closest (np.nan if farther
+    than threshold, on either side). source_df is sorted once and all rows are paired by binary search"""
+    keys   = source_df[col].to_numpy(dtype=np.float64)
+    values = source_df[val].to_numpy(dtype=np.float64)
+    known  = ~np.isnan(keys)
+    keys, values = keys[known], values[known]
+    queries = target_df[col].to_numpy(dtype=np.float64)
+    if len(keys) == 0: return np.full(len(queries), np.nan)
+
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    position = np.searchsorted(keys, queries)
+    left  = np.clip(position - 1, 0, len(keys) - 1)
+    right = np.clip(position, 0, len(keys) - 1)
+    closest  = np.where(np.abs(keys[right] - queries) < np.abs(keys[left] - queries), right, left) # ties: lower key
+    distance = np.abs(keys[closest] - queries)
+
+    matched = values[closest]
+    matched[~(distance <= threshold)] = np.nan # also catches nan queries
+    return matched
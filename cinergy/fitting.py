@@ -0,0 +1,110 @@
+import numpy as np
+
+MAX_DEGREE = 14 # Degrees 1 to MAX_DEGREE are considered
+FOLDS      = 5
+SEED       = 0  # Fold assignment is seeded so that degree selection is reproducible
+RANK_TOL   = 1e-10
+
+class PowerModel(object):
+    """Polynomial power model f(x) = intercept + sum(coefficients[d]*x**d). coefficients[0] is kept to 0 so that the
+    model can still be unpacked as the (intercept, coefficients) tuple previously returned by sklearn"""
+
+    def __init__(self, intercept : float, coefficients : np.ndarray, degree : int, stats : dict = None):
+        self.intercept    = float(intercept)
+        self.coefficients = np.asarray(coefficients, dtype=np.float64)
+        self.degree       = int(degree)
+        self.stats        = stats if stats is not None else dict()
+
+    def __iter__(self):
+        return iter((self.intercept, self.coefficients))
+
+    def to_dict(self):
+        return {'intercept': self.intercept, 'coefficients': self.coefficients.tolist(), 'degree': self.degree, 'stats': self.stats}
+
+    @staticmethod
+    def from_dict(content : dict):
+        return PowerModel(intercept=content['intercept'], coefficients=content['coefficients'], degree=content['degree'], stats=content.get('stats'))
+
+    def __repr__(self):
+        return 'PowerModel(degree=' + str(self.degree) + ', intercept=' + str(self.intercept) + ', stats=' + str(self.stats) + ')'
+
+def vandermonde(x : np.ndarray, degree : int = MAX_DEGREE):
+    return np.power.outer(x, np.arange(degree+1))
+
+def __fit_all_degrees(vander : np.ndarray, y : np.ndarray):
+    """Least squares of every degree from a single QR factorization: as Vandermonde columns are nested, the solution
+    of degree d only uses the leading (d+1)x(d+1) block of R. Column d of the returned matrix holds the coefficients
+    of degree d (np.nan if the data cannot support this degree)"""
+    q, r = np.linalg.qr(vander)
+    b    = q.T @ y
+    diag = np.abs(np.diag(r))
+    supported = int(np.cumprod(diag > RANK_TOL * diag[0]).sum()) if diag[0] > 0 else 0
+    coefficients = np.full((vander.shape[1], vander.shape[1]), np.nan)
+    if supported > 0:
+        # inv(R) is upper triangular, hence coefficients of degree d are the cumulated sum of the first d+1 columns
+        partial = np.linalg.solve(r[:supported, :supported], np.diag(b[:supported]))
+        coefficients[:, :supported] = 0
+        coefficients[:supported, :supported] = np.cumsum(partial, axis=1)
+    return coefficients
+
+def cross_validate(vander : np.ndarray, y : np.ndarray, folds : int = FOLDS, seed : int = SEED):
+    """Return the k-fold cross-validated RMSE of every degree (np.inf for unsupported degrees)"""
+    assignment = np.random.default_rng(seed).permutation(len(y)) % folds
+    squared_error = np.zeros(vander.shape[1])
+    for fold in range(folds):
+        train, valid = assignment != fold, assignment == fold
+        if not valid.any(): continue
+        coefficients = __fit_all_degrees(vander[train], y[train])
+        squared_error += ((vander[valid] @ coefficients - y[valid, None])**2).sum(axis=0)
+    squared_error[np.isnan(squared_error)] = np.inf
+    return np.sqrt(squared_error/len(y))
+
+def fit(x, y, max_degree : int = MAX_DEGREE, folds : int = FOLDS, seed : int = SEED):
+    """Fit a polynomial model of y on x, the degree being the one with the lowest cross-validated RMSE (lowest degree
+    on ties). Raise ValueError if x has less than two distinct values, as not even degree 1 can be fitted"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    distinct = len(np.unique(x))
+    if distinct < 2: raise ValueError('Cannot fit a power model on ' + str(distinct) + ' distinct cpu usage value(s), at least 2 are needed')
+    scale  = np.abs(x).max() if len(x) and np.abs(x).max() > 0 else 1.0 # Conditioning of high degrees
+    vander = vandermonde(x/scale, degree=max_degree)
+
+    cv_rmse = cross_validate(vander, y, folds=folds, seed=seed)
+    degree  = 1 + int(np.argmin(cv_rmse[1:]))
+
+    scaled  = __fit_all_degrees(vander, y)[:degree+1, degree]
+    coefficients = scaled / (scale ** np.arange(degree+1))
+    y_predict = vander[:, :degree+1] @ scaled
+    residual  = y - y_predict
+    stats = {'n': len(y),
+             'rmse': float(np.sqrt(np.mean(residual**2))),
+             'mae': float(np.mean(np.abs(residual))),
+             'r2': float(1 - (residual**2).sum()/((y - y.mean())**2).sum()),
+             'cv_rmse': float(cv_rmse[degree])}
+    intercept = coefficients[0]
+    coefficients[0] = 0
+    return PowerModel(intercept=intercept, coefficients=coefficients, degree=degree, stats=stats)
+
+def compute_models(training_dict : dict, exclude_beyond : int = None, verbose : bool = False, folds : int = FOLDS, seed : int = SEED):
+    """Fit a model per training level (dict of wide datasets as returned by the loader)"""
+    model_dict = {}
+    for level, dataset in training_dict.items():
+        clean_training = dataset.dropna()
+        if exclude_beyond is not None:
+            clean_training = clean_training.loc[clean_training['cpu%_package-global'] <= exclude_beyond]
+        try:
+            model = fit(clean_training['cpu%_package-global'], clean_training['package-global-watt'], folds=folds, seed=seed)
+        except ValueError as err:
+            raise ValueError(str(level) + ': ' + str(err)) from err
+        if verbose: print(level, '- best degree', model.degree, 'formula:', formula_as_str(*model))
+        if verbose: print(level, '- r2_score /1', model.stats['r2'])
+        if verbose: print(level, '- RMSE', model.stats['rmse'], '(cross-validated', str(model.stats['cv_rmse']) + ')')
+        if verbose: print(level, '- mean absolute error', model.stats['mae'])
+        model_dict[level] = model
+    return model_dict
+
+def formula_as_str(intercept, coef):
+    formula = str(intercept)
+    for i in range(len(coef)):
+        formula+= ' + ' + str(coef[i]) + '*(x**' + str(i) + ')'
+    return 'f(x) = ' + formula
@@ -0,0 +1,74 @@
+import glob
+import numpy as np
+import pandas as pd
+
+KEEP_AS_STR = ['timestamp', 'phase'] # Columns not converted to numeric values
+CHUNK_SIZE  = 10**6 # CSV lines per chunk
+
+def format_csv(path : str, chunksize : int = CHUNK_SIZE):
+    """Convert the long timestamp,domain,measure CSV of read_system to a wide frame (one row per timestamp, one
+    column per domain). The CSV is streamed by chunk so that only the wide frame is kept in memory.
+    On duplicated (timestamp, domain) keys, the first measure is kept"""
+    domains_order = dict() # Order of first appearance, as columns
+    wide_chunks = list()
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype={'domain': str, 'measure': str}):
+        domains_order.update(dict.fromkeys(chunk['domain'].unique()))
+        wide_chunks.append(__pivot_chunk(chunk))
+
+    if not wide_chunks: return pd.DataFrame({'timestamp': []})
+    wide = pd.concat(wide_chunks)
+    if wide.index.has_duplicates: # Timestamp spread over multiple chunks
+        wide = wide.groupby(level=0, sort=False).first()
+    wide = wide.reindex(columns=list(domains_order.keys()))
+    return __finalize(wide)
+
+def __pivot_chunk(chunk : pd.DataFrame):
+    chunk = chunk.drop_duplicates(subset=['timestamp', 'domain'], keep='first')
+    wide  = chunk.pivot(index='timestamp', columns='domain', values='measure')
+    wide  = wide.reindex(index=pd.unique(chunk['timestamp'])) # pivot sorts, we keep the file order
+    for key in wide.columns:
+        if key not in KEEP_AS_STR: wide[key] = pd.to_numeric(wide[key], errors='coerce')
+    return wide
+
+def __finalize(wide : pd.DataFrame):
+    wide.index.name = 'timestamp'
+    wide.columns.name = None
+    output_df = wide.reset_index()
+    for key in output_df.keys():
+        if key not in KEEP_AS_STR: output_df[key] = pd.to_numeric(output_df[key], errors='coerce', downcast="float")
+    return output_df
+
+def format_npz(path_prefix : str):
+    """Load the wide NumPy chunks (path_prefix-XXXXX.npz) written by read_system with --format=npz"""
+    chunks = list()
+    for path in sorted(glob.glob(path_prefix + '-[0-9][0-9][0-9][0-9][0-9].npz')):
+        with np.load(path) as archive:
+            chunks.append(pd.DataFrame({key: archive[key] for key in archive.files}))
+    if not chunks: return pd.DataFrame({'timestamp': []})
+    wide = pd.concat(chunks, ignore_index=True)
+    if 'phase' in wide: wide['phase'] = wide['phase'].replace('', np.nan)
+    wide = wide.groupby('timestamp', sort=False).first() # Same semantic as the CSV: first measure of a timestamp
+    return __finalize(wide)
+
+def load_dataset(path : str):
+    """Load a dataset from its CSV path, falling back to NumPy chunks sharing the same prefix"""
+    if glob.glob(path): return format_csv(path)
+    return format_npz(path[:-len('.csv')] if path.endswith('.csv') else path)
+
+# Datasets of the paper, once compressed-data/data.tar.gz is extracted (XXX is replaced by the phase)
+REFERENCE_HOSTS = {
+    'nova':   ('data/241029-nova/nova-12.lyon.grid5000.fr-XXX.csv', 32),        # Xeon 2016 (16/32, dual)
+    'grappe': ('data/241030-grappe/grappe-11.nancy.grid5000.fr-XXX.csv', 80),   # Xeon 2020 (40/80, dual)
+    'chirop': ('data/241031-chirop/chirop-4.lille.grid5000.fr-XXX.csv', 128),   # Xeon 2021 (64/128, dual)
+    'grue':   ('data/241031-grue/grue-2.nancy.grid5000.fr-XXX.csv', 64),        # Zen 1 (32/64, dual)
+    'servan': ('data/241030-servan/servan-2.grenoble.grid5000.fr-XXX.csv', 96), # Zen 2 (48/96, dual)
+    'chuc':   ('data/241030-chuc/chuc-6.lille.grid5000.fr-XXX.csv', 64),        # Zen 3 (32/64, single)
+}
+TRAINING_LEVELS = ['25', '50', '100']
+
+def load_training(pattern : str):
+    return {level: load_dataset(pattern.replace('XXX', 'training-' + level)) for level in TRAINING_LEVELS}
+
+def load_host(pattern : str):
+    """Load the training datasets, the groundtruth and the cloudlike datasets of a host"""
+    return load_training(pattern), load_dataset(pattern.replace('XXX', 'groundtruth')), load_dataset(pattern.replace('XXX', 'cloudlike'))
@@ -0,0 +1,182 @@
+import sys, getopt, time, hashlib, json, pickle
+from os import makedirs, replace, getpid
+from os.path import join, exists
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from cinergy.loader import REFERENCE_HOSTS, TRAINING_LEVELS, load_dataset
+from cinergy.fitting import compute_models, PowerModel, FOLDS, SEED, MAX_DEGREE
+from cinergy.evaluation import estimate, match_closest
+
+CACHE_FOLDER  = '.cinergy-cache'
+MODEL_FOLDER  = 'models'
+PHASES        = ['training-' + level for level in TRAINING_LEVELS] + ['groundtruth', 'cloudlike']
+VM_SIZE       = 4
+MODEL_LEVEL   = '50'
+HASH_BLOCK    = 2**20
+
+def print_usage():
+    print('python3 -m cinergy.pipeline [--help] [--root=. (folder where data.tar.gz was extracted)] [--host=nova,grappe,...] [--workers=0 (one per host)] [--cache=' + CACHE_FOLDER + '] [--models=' + MODEL_FOLDER + '] [--level=' + MODEL_LEVEL + '] [--vm-size=' + str(VM_SIZE) + '] [--exclude-beyond=(vm-size*100/host core*3)]')
+
+###########################################
+# Content-addressed cache
+###########################################
+def file_hash(path : str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''): digest.update(block)
+    return digest.hexdigest()
+
+def params_hash(**params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def cache_get(cache : str, key : str):
+    if cache is None or not exists(join(cache, key + '.pkl')): return None
+    path = join(cache, key + '.pkl')
+    with open(path, 'rb') as f: return pickle.load(f)
+
+def cache_set(cache : str, key : str, content):
+    if cache is None: return
+    makedirs(cache, exist_ok=True)
+    path = join(cache, key + '.pkl')
+    temporary = path + '.' + str(getpid()) + '.tmp' # Workers may share identical datasets
+    with open(temporary, 'wb') as f: pickle.dump(content, f)
+    replace(temporary, path) # An interrupted run never leaves a truncated entry
+
+###########################################
+# Stages
+###########################################
+def load_stage(paths : dict, hashes : dict, cache : str):
+    datasets = dict()
+    for phase, path in paths.items():
+        key = 'dataset-' + hashes[phase]
+        dataset = cache_get(cache, key)
+        if dataset is None:
+            dataset = load_dataset(path)
+            cache_set(cache, key, dataset)
+        datasets[phase] = dataset
+    return datasets
+
+def fit_stage(datasets : dict, exclude_beyond : float, key : str, cache : str):
+    models = cache_get(cache, key)
+    if models is None:
+        training_dict = {level: datasets['training-' + level] for level in TRAINING_LEVELS}
+        models = {level: model.to_dict() for level, model in compute_models(training_dict=training_dict, exclude_beyond=exclude_beyond).items()}
+        cache_set(cache, key, models)
+    return {level: PowerModel.from_dict(model) for level, model in models.items()}
+
+def evaluate_stage(datasets : dict, model : PowerModel, core_host : int):
+    groundtruth = datasets['groundtruth'].dropna()
+    groundtruth = groundtruth.assign(host_percent_vm = groundtruth.vm / core_host)
+    evaluation_df = datasets['cloudlike'].dropna()
+    evaluation_df = evaluation_df.assign(host_percent_vm = evaluation_df.vm / core_host)
+    evaluation_df = evaluation_df.assign(groundtruth = match_closest(groundtruth, 'host_percent_vm', evaluation_df, 'package-global-watt'),
+                                         prediction = estimate(model, evaluation_df['vm'], core_host=core_host))
+    evaluation_df = evaluation_df.dropna()
+    y, y_predict = evaluation_df['groundtruth'].to_numpy(), evaluation_df['prediction'].to_numpy()
+    if len(y) == 0: return {'samples': 0}
+    return {'samples': len(y),
+            'r2': float(1 - ((y - y_predict)**2).sum()/((y - y.mean())**2).sum()),
+            'rmse': float(np.sqrt(np.mean((y - y_predict)**2))),
+            'mape': float(np.mean(np.abs(y - y_predict)/np.abs(y)))}
+
+def run_host(name : str, pattern : str, core_host : int, level : str, vm_size : int, exclude_beyond : float, cache : str):
+    """Load, fit and evaluate a host, each stage being cached. Return the results and timing of each stage"""
+    timing = dict()
+    if exclude_beyond is None: exclude_beyond = (vm_size * 100) / core_host * 3
+    paths  = {phase: pattern.replace('XXX', phase) for phase in PHASES}
+
+    begin  = time.perf_counter()
+    hashes = {phase: file_hash(path) for phase, path in paths.items()}
+    timing['hash'] = time.perf_counter() - begin
+    fit_key = 'models-' + params_hash(training=[hashes['training-' + level] for level in TRAINING_LEVELS], exclude_beyond=exclude_beyond,
+                                      folds=FOLDS, seed=SEED, max_degree=MAX_DEGREE)
+    result_key = 'result-' + params_hash(models=fit_key, level=level, core_host=core_host, groundtruth=hashes['groundtruth'], cloudlike=hashes['cloudlike'])
+
+    result = cache_get(cache, result_key)
+    if result is not None: # Unchanged host
+        result['timing'] = timing
+        result['cached'] = True
+        return result
+
+    begin = time.perf_counter()
+    datasets = load_stage(paths=paths, hashes=hashes, cache=cache)
+    timing['load'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    models = fit_stage(datasets=datasets, exclude_beyond=exclude_beyond, key=fit_key, cache=cache)
+    timing['fit'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    metrics = evaluate_stage(datasets=datasets, model=models[level], core_host=core_host)
+    timing['evaluate'] = time.perf_counter() - begin
+
+    result = {'name': name, 'core_host': core_host, 'level': level, 'exclude_beyond': exclude_beyond,
+              'models': {level: model.to_dict() for level, model in models.items()}, 'metrics': metrics}
+    cache_set(cache, result_key, result)
+    result['timing'] = timing
+    result['cached'] = False
+    return result
+
+def export_model(result : dict, folder : str):
+    """Serialized model (with host core count) as loaded by cinergy-model.py"""
+    makedirs(folder, exist_ok=True)
+    content = dict(result['models'][result['level']])
+    content['core_host'] = result['core_host']
+    content['level'] = result['level']
+    with open(join(folder, result['name'] + '.json'), 'w') as f: json.dump(content, f, indent=1)
+
+###########################################
+# Entrypoint
+###########################################
+if __name__ == '__main__':
+
+    root, hosts, workers, cache, models_folder = '.', list(REFERENCE_HOSTS.keys()), 0, CACHE_FOLDER, MODEL_FOLDER
+    level, vm_size, exclude_beyond = MODEL_LEVEL, VM_SIZE, None
+    try:
+        arguments, values = getopt.getopt(sys.argv[1:], 'hr:w:', ['help', 'root=', 'host=', 'workers=', 'cache=', 'no-cache', 'models=', 'level=', 'vm-size=', 'exclude-beyond='])
+    except getopt.error as err:
+        print(str(err))
+        print_usage()
+        sys.exit(-1)
+    for current_argument, current_value in arguments:
+        if current_argument in ('-h', '--help'):
+            print_usage()
+            sys.exit(0)
+        elif current_argument in ('-r', '--root'):
+            root = current_value
+        elif current_argument == '--host':
+            hosts = current_value.split(',')
+        elif current_argument in ('-w', '--workers'):
+            workers = int(current_value)
+        elif current_argument == '--cache':
+            cache = current_value
+        elif current_argument == '--no-cache':
+            cache = None
+        elif current_argument == '--models':
+            models_folder = current_value
+        elif current_argument == '--level':
+            level = current_value
+        elif current_argument == '--vm-size':
+            vm_size = int(current_value)
+        elif current_argument == '--exclude-beyond':
+            exclude_beyond = float(current_value)
+
+    tasks = dict()
+    for name in hosts:
+        pattern, core_host = REFERENCE_HOSTS[name]
+        pattern = join(root, pattern)
+        if not all([exists(pattern.replace('XXX', phase)) for phase in PHASES]):
+            print(name, 'skipped, missing data in', root)
+            continue
+        tasks[name] = dict(name=name, pattern=pattern, core_host=core_host, level=level, vm_size=vm_size, exclude_beyond=exclude_beyond, cache=cache)
+
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers if workers > 0 else max(1, len(tasks))) as executor:
+        futures = {executor.submit(run_host, **task): name for name, task in tasks.items()}
+        for future in as_completed(futures):
+            result = future.result()
+            export_model(result=result, folder=models_folder)
+            timing = ' '.join([stage + ' ' + str(round(duration, 3)) + 's' for stage, duration in result['timing'].items()])
+            print(result['name'], '(cached)' if result['cached'] else '', timing)
+            print(' ', 'model', level, 'degree', result['models'][level]['degree'], '|', ' '.join([metric + ' ' + str(round(value, 4)) for metric, value in result['metrics'].items()]))
+    print('Pipeline done in', round(time.perf_counter() - begin, 3), 's')
@@ -0,0 +1,15 @@
+import sys, importlib.util
+from os.path import dirname, abspath, join
+import pytest
+
+ROOT = join(dirname(abspath(__file__)), '..')
+sys.path.insert(0, join(ROOT, 'bench')) # Fake host fixtures
+
+@pytest.fixture
+def sampler():
+    """cinergy-model.py is a script (not importable by name): load a fresh copy of it for each test, as its globals
+    are redirected to fixtures"""
+    spec = importlib.util.spec_from_file_location('cinergy_model', join(ROOT, 'cinergy-model.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
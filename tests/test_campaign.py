@@ -0,0 +1,75 @@
+import os, glob
+from os.path import join
+import numpy as np
+import pytest
+from fixtures import Fixture, use_fixture
+
+def campaign_at(sampler, tmp_path, output_format : str, position : int):
+    sampler.OUTPUT_PREFIX = join(str(tmp_path), 'consumption')
+    sampler.OUTPUT_FORMAT = output_format
+    campaign = sampler.Campaign(path=sampler.OUTPUT_PREFIX + '-manifest.json', parameters={}, resume=False)
+    campaign.phases['training-25'] = {'steps': 3, 'done': False, 'position': position, 'elapsed': 10**9}
+    return campaign
+
+def test_csv_resume_point(sampler, tmp_path):
+    campaign = campaign_at(sampler, tmp_path, 'csv', position=100)
+    path = sampler.OUTPUT_PREFIX + '-training-25.csv'
+    assert campaign.resume_point('training-25') == (0, None) # Missing output
+    with open(path, 'w') as f: f.write('x' * 50)
+    assert campaign.resume_point('training-25') == (0, None) # Shorter than the checkpoint
+    with open(path, 'w') as f: f.write('x' * 120)
+    assert campaign.resume_point('training-25') == (3, (100, 10**9)) # Written after the checkpoint, to be truncated
+
+def test_npz_resume_point(sampler, tmp_path):
+    campaign = campaign_at(sampler, tmp_path, 'npz', position=2)
+    chunk = lambda number: sampler.OUTPUT_PREFIX + '-training-25-' + str(number).zfill(5) + '.npz'
+    for number in [0, 2]: open(chunk(number), 'wb').close()
+    assert campaign.resume_point('training-25') == (0, None) # Chunk 1 is missing
+    open(chunk(1), 'wb').close()
+    assert campaign.resume_point('training-25') == (3, (2, 10**9))
+    os.remove(chunk(2))
+    assert campaign.resume_point('training-25') == (3, (2, 10**9))
+
+class StepInterrupt(object):
+    """Load controller raising KeyboardInterrupt when a given number of workers is requested"""
+    def __init__(self, at : int = None): self.at = at
+    def set_load(self, workers : int, load_percentage : float):
+        if workers == self.at: raise KeyboardInterrupt()
+
+def run_phase(sampler, fixture, output_format : str, resume : bool, interrupt_at : int = None, flush_size : int = 3):
+    sampler.OUTPUT_FORMAT, sampler.OUTPUT_FLUSH_SIZE = output_format, flush_size # By default, batches end in the middle of steps
+    sampler.MODEL_ITERATION, sampler.MODEL_MEASURE_WINDOW = 2, 0
+    sampler.load_controller = StepInterrupt(at=interrupt_at)
+    sampler.campaign = sampler.Campaign(path=sampler.OUTPUT_PREFIX + '-manifest.json', parameters={}, resume=resume)
+    topology = sampler.find_topology()
+    try:
+        sampler.noise(rapl_sysfs=sampler.find_rapl_sysfs(), cpuid_per_numa=topology.cpuid_per_numa(), cache_topo=topology.cache_topo(), label='training-50', load_percentage=50)
+    except KeyboardInterrupt:
+        pass
+    sampler.close_output()
+
+def targets(sampler, output_format : str):
+    if output_format == 'csv':
+        with open(sampler.OUTPUT_PREFIX + '-training-50.csv', 'r') as f:
+            return [int(line.split(',')[2]) for line in f if ',target,' in line]
+    chunks = sorted(glob.glob(sampler.OUTPUT_PREFIX + '-training-50-*.npz'))
+    return [int(target) for chunk in chunks for target in np.load(chunk)['target']]
+
+@pytest.mark.parametrize('output_format', ['csv', 'npz'])
+def test_interrupted_phase_resumes_at_a_step_boundary(sampler, tmp_path, output_format):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1)
+    use_fixture(sampler, fixture)
+    sampler.OUTPUT_PREFIX = join(str(tmp_path), 'consumption')
+    run_phase(sampler, fixture, output_format, resume=False, interrupt_at=3)
+    assert 0 < sampler.campaign.phases['training-50']['steps'] <= 3
+    run_phase(sampler, fixture, output_format, resume=True)
+    assert targets(sampler, output_format) == [target for target in [0, 25, 50, 75, 100] for _ in range(2)] # each step once
+    assert sampler.campaign.is_done('training-50')
+
+def test_steps_do_not_force_npz_chunks(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1)
+    use_fixture(sampler, fixture)
+    sampler.OUTPUT_PREFIX = join(str(tmp_path), 'consumption')
+    run_phase(sampler, fixture, 'npz', resume=False, flush_size=5000)
+    assert len(glob.glob(sampler.OUTPUT_PREFIX + '-training-50-*.npz')) == 1 # Flushed once, at the end of the phase
+    assert sampler.campaign.is_done('training-50')
@@ -0,0 +1,14 @@
+import numpy as np
+import pytest
+from cinergy.fitting import fit
+
+def test_linear_model_is_recovered():
+    x = np.arange(0, 100, 5, dtype=np.float64)
+    model = fit(x, 40 + 0.8*x)
+    assert model.degree == 1
+    assert model.intercept == pytest.approx(40)
+    assert model.coefficients[1] == pytest.approx(0.8)
+
+def test_single_cpu_usage_value_is_rejected():
+    with pytest.raises(ValueError, match='1 distinct'):
+        fit(np.full(10, 5.), range(10))
@@ -0,0 +1,62 @@
+import time
+import pytest
+
+libvirt = pytest.importorskip('libvirt')
+
+STATS = ['block.{}.rd.bytes', 'block.{}.wr.bytes', 'net.{}.rx.bytes', 'net.{}.tx.bytes']
+
+@pytest.fixture
+def connector(sampler):
+    libvirt.virEventRegisterDefaultImpl()
+    connector = libvirt.open('test:///default') # Fresh driver state with a single running domain named test
+    sampler.libvirt, sampler.VM_CONNECTOR = libvirt, connector
+    yield connector
+    connector.close()
+
+def expected_measures(domain, stats : dict):
+    """Per domain metrics that read_libvirt should derive from the bulk statistics of the domain"""
+    prefix = 'libvirt_vm-' + domain.name() + '_'
+    expected = dict()
+    vcpu_time = [value for key, value in stats.items() if key.startswith('vcpu.') and key.endswith('.time')]
+    if vcpu_time: expected[prefix + 'vcpu_time'] = sum(vcpu_time)
+    if 'balloon.current' in stats: expected[prefix + 'mem_balloon'] = int(stats['balloon.current']/1024)
+    for counter in STATS:
+        device_type = counter.split('.')[0]
+        values = [stats[counter.format(index)] for index in range(stats.get(device_type + '.count', 0)) if counter.format(index) in stats]
+        if values: expected[prefix + counter.replace('.{}.', '_').replace('.', '_')] = sum(values)
+    return expected
+
+def test_bulk_statistics(sampler, connector):
+    measures = sampler.read_libvirt()
+    domain = connector.lookupByName('test')
+    assert measures['libvirt_vm_count'] == 1
+    assert measures['libvirt_vm_cpu_cml'] == domain.maxVcpus()
+    assert measures['libvirt_vm_mem_cml'] == int(domain.maxMemory()/1024)
+    try:
+        (_, stats), = connector.getAllDomainStats(libvirt.VIR_DOMAIN_STATS_VCPU | libvirt.VIR_DOMAIN_STATS_BALLOON | libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE)
+    except libvirt.libvirtError:
+        pytest.skip('test driver without bulk statistics')
+    static = sampler.libvirt_static_cache[domain.UUIDString()]
+    if 'vcpu.maximum' in stats: assert static['vcpu'] == stats['vcpu.maximum']
+    if 'balloon.maximum' in stats: assert static['memory'] == int(stats['balloon.maximum']/1024)
+    for metric, value in expected_measures(domain, stats).items():
+        if not metric.endswith('vcpu_time'): assert measures[metric] == value # vCPU time moves between the two calls
+        else: assert measures[metric] <= value
+
+def test_fallback_without_bulk_statistics(sampler, connector, monkeypatch):
+    def unsupported(*args, **kwargs): raise libvirt.libvirtError('unsupported')
+    monkeypatch.setattr(connector, 'getAllDomainStats', unsupported)
+    domain = connector.lookupByName('test')
+    measures = sampler.read_libvirt()
+    assert measures == {'libvirt_vm_count': 1, 'libvirt_vm_cpu_cml': domain.maxVcpus(), 'libvirt_vm_mem_cml': int(domain.maxMemory()/1024)}
+
+def test_lifecycle_event_invalidates_static_attributes(sampler, connector):
+    sampler.watch_libvirt_lifecycle(connector)
+    sampler.read_libvirt()
+    domain = connector.lookupByName('test')
+    assert domain.UUIDString() in sampler.libvirt_static_cache
+    domain.destroy()
+    deadline = time.monotonic() + 5
+    while domain.UUIDString() in sampler.libvirt_static_cache and time.monotonic() < deadline: time.sleep(0.01)
+    assert domain.UUIDString() not in sampler.libvirt_static_cache
+    assert sampler.read_libvirt()['libvirt_vm_count'] == 0
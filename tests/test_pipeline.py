@@ -0,0 +1,22 @@
+import threading
+
+class ListWriter(object):
+    def __init__(self): self.records = list()
+    def write(self, timestamp : int, measures : dict): self.records.append(timestamp)
+
+def record_at(sampler, timestamp : int):
+    return sampler.SampleRecord(timestamp=timestamp, misc={}, rapl={}, cpu={}, cache={}, sampler={}, estimation={})
+
+def test_drain_does_not_wait_for_display(sampler, monkeypatch):
+    blocked = threading.Event()
+    monkeypatch.setattr(sampler.DisplayConsumer, 'handle', lambda self, records: blocked.wait()) # e.g. terminal blocked
+    sampler.LIVE_DISPLAY = True
+    sampler.output_writer = ListWriter()
+    pipeline = sampler.SamplePipeline(size=4)
+    for timestamp in range(10): pipeline.push(record_at(sampler, timestamp))
+    drained = threading.Thread(target=pipeline.drain)
+    drained.start()
+    drained.join(timeout=5)
+    assert not drained.is_alive()
+    assert sampler.output_writer.records[-1] == 9
+    blocked.set()
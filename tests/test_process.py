@@ -0,0 +1,24 @@
+from os.path import join
+from fixtures import Fixture, use_fixture
+
+def test_vm_caught_before_exec_is_found(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1, vm=1, vcpu=2)
+    use_fixture(sampler, fixture)
+    pid = list(fixture.vms.keys())[0]
+    comm = join(str(tmp_path), 'proc', str(pid), 'comm')
+    with open(comm, 'w') as f: f.write('libvirtd\n') # Forked by libvirt, not yet exec'd
+    scanner = sampler.ProcessScanner(keyword='qemu')
+    assert scanner.scan() == {}
+    with open(comm, 'w') as f: f.write('qemu-system-x86\n')
+    process = scanner.scan()
+    assert list(process.keys()) == [pid]
+    assert sorted(process[pid].keys()) == fixture.vms[pid]
+    assert scanner.names[pid] == 'vm0'
+
+def test_other_processes_are_ignored_after_rechecks(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1, vm=0)
+    use_fixture(sampler, fixture)
+    scanner = sampler.ProcessScanner(keyword='qemu')
+    for _ in range(sampler.SCAN_RECHECK + 1): scanner.scan()
+    assert scanner.pending == {}
+    assert len(scanner.ignored) == 3 # systemd, sshd and bash of the fixture
@@ -0,0 +1,64 @@
+from fixtures import Fixture, use_fixture
+
+RANGE = 2**32 # uJ, above the RAPL_MAX_POWER bound of a 1 s interval (10**9 uJ)
+SECOND = 10**9 # ns
+
+def test_single_wrap_is_corrected(sampler):
+    hist = {'package-0': RANGE - 100, 'time': 0}
+    joule, watt = sampler.read_joule_file(domain='package-0', uj_count=50, hist=hist, current_time=SECOND, energy_range=RANGE)
+    assert joule == 150 / 10**6
+    assert watt == 150 / 10**6
+    assert hist['total']['package-0'] == 150
+    assert hist['package-0'] == 50
+
+def test_several_wraps_possible_is_invalid(sampler):
+    hist = {'package-0': 1000, 'time': 0, 'total': {'package-0': 42}}
+    # 1000 W during 5 s may have wrapped the counter more than once
+    assert sampler.read_joule_file(domain='package-0', uj_count=2000, hist=hist, current_time=5*SECOND, energy_range=RANGE) == (None, None)
+    assert hist['total']['package-0'] == 42
+    # Next interval is measured again from the new reference
+    hist['time'] = 5*SECOND
+    joule, _ = sampler.read_joule_file(domain='package-0', uj_count=3000, hist=hist, current_time=6*SECOND, energy_range=RANGE)
+    assert joule == 1000 / 10**6
+    assert hist['total']['package-0'] == 1042
+
+def test_unknown_range_drops_overflow(sampler):
+    hist = {'dram-0': 5000, 'time': 0}
+    assert sampler.read_joule_file(domain='dram-0', uj_count=100, hist=hist, current_time=SECOND, energy_range=None) == (None, None)
+    assert 'dram-0' not in hist.get('total', {})
+    hist['time'] = SECOND
+    joule, _ = sampler.read_joule_file(domain='dram-0', uj_count=600, hist=hist, current_time=2*SECOND, energy_range=None)
+    assert joule == 500 / 10**6
+
+def test_total_energy_across_fast_wraps(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=2, cores=2, smt=1, rapl_range=2**30)
+    use_fixture(sampler, fixture)
+    rapl_sysfs = sampler.find_rapl_sysfs()
+    energy_range = sampler.find_rapl_range(rapl_sysfs)
+    reader = sampler.SysfsReader(paths=rapl_sysfs)
+    hist = {domain: None for domain in rapl_sysfs.keys()}
+    sampler.read_rapl(rapl_reader=reader, hist=hist, current_time=0, energy_range=energy_range)
+    consumed = dict(fixture.consumed)
+    for tick in range(1, 101):
+        fixture.advance(duration=1)
+        measures = sampler.read_rapl(rapl_reader=reader, hist=hist, current_time=tick*SECOND, energy_range=energy_range)
+        assert 'package-global-watt' in measures
+    reader.close()
+    assert fixture.wraps > 0
+    for domain, path in rapl_sysfs.items():
+        zone = path.split('/')[-2]
+        assert hist['total'][domain] == fixture.consumed[zone] - consumed[zone]
+
+def test_interval_too_long_skips_tick(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1, rapl_range=2**30)
+    use_fixture(sampler, fixture)
+    rapl_sysfs = sampler.find_rapl_sysfs()
+    energy_range = sampler.find_rapl_range(rapl_sysfs)
+    reader = sampler.SysfsReader(paths=rapl_sysfs)
+    hist = {domain: None for domain in rapl_sysfs.keys()}
+    sampler.read_rapl(rapl_reader=reader, hist=hist, current_time=0, energy_range=energy_range)
+    fixture.advance(duration=2)
+    assert sampler.read_rapl(rapl_reader=reader, hist=hist, current_time=2*SECOND, energy_range=energy_range) == {}
+    fixture.advance(duration=1)
+    assert 'package-global-watt' in sampler.read_rapl(rapl_reader=reader, hist=hist, current_time=3*SECOND, energy_range=energy_range)
+    reader.close()
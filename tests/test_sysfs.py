@@ -0,0 +1,17 @@
+from os.path import join
+
+def test_long_watch_file_is_read_whole(sampler, tmp_path):
+    online = join(str(tmp_path), 'online')
+    cpus = ','.join(str(cpu) for cpu in range(0, 256, 2)) # SMT disabled cpu by cpu
+    with open(online, 'w') as f: f.write(cpus + '\n')
+    counter = join(str(tmp_path), 'energy_uj')
+    with open(counter, 'w') as f: f.write('42\n')
+    reader = sampler.SysfsReader(paths={'package-0': counter}, watch=online)
+    assert reader.watch_content == (cpus + '\n').encode()
+    fds = dict(reader.fds)
+    assert reader.read() == {'package-0': 42}
+    assert reader.fds == fds # No change: files are not re-opened
+    with open(online, 'w') as f: f.write(cpus.replace(',254', '') + '\n') # Change past the initial buffer size
+    reader.read()
+    assert reader.watch_content == (cpus.replace(',254', '') + '\n').encode()
+    reader.close()
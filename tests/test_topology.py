@@ -0,0 +1,22 @@
+import os, json
+from os.path import join, exists
+from fixtures import Fixture, use_fixture
+
+def test_snapshot_per_host(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=2, cores=4, smt=2)
+    use_fixture(sampler, fixture)
+    topology = sampler.find_topology()
+    path = join(str(tmp_path), 'topology-' + os.uname().nodename + '.json')
+    assert exists(path)
+    assert sampler.find_topology() == topology # Loaded from the snapshot
+    assert topology.cpuid_per_numa() == {0: ['cpu' + str(cpu) for cpu in [0, 1, 2, 3, 8, 9, 10, 11]], 1: ['cpu' + str(cpu) for cpu in [4, 5, 6, 7, 12, 13, 14, 15]]}
+    assert set(topology.cache_topo().keys()) == {'L3-0', 'L3-1'}
+    assert len(topology.siblings) == 8
+
+def test_snapshot_of_another_host_is_kept(sampler, tmp_path):
+    fixture = Fixture(root=str(tmp_path), sockets=1, cores=2, smt=1)
+    use_fixture(sampler, fixture)
+    other = join(str(tmp_path), 'topology-other-host.json')
+    with open(other, 'w') as f: json.dump({'fingerprint': {}, 'topology': {}}, f)
+    sampler.find_topology()
+    with open(other, 'r') as f: assert json.load(f) == {'fingerprint': {}, 'topology': {}}